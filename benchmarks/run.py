@@ -0,0 +1,375 @@
+# 一括更新パイプラインのオフラインベンチマーク
+#
+#   python benchmarks/run.py                      # 計測してベースラインと比較
+#   python benchmarks/run.py --save-baseline      # 今回の結果をベースラインとして保存
+#   python benchmarks/run.py --banks 10 100 --llm-latency 0.5 --llm-error-rate 0.1
+#
+# Gemini / DuckDuckGo / 銀行サイト / Google Sheets / Chrome はすべて stubs.py の代役に
+# 差し替えるので、APIキーもネットワークも要らない。ベースラインより遅くなった項目が
+# あれば終了コード 1 を返す。
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter, defaultdict
+
+from streamlit import config as streamlit_config
+from streamlit import logger as streamlit_logger
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+sys.path.insert(0, HERE)
+
+# アプリの読み込み前に決める設定 (キャッシュ置き場とキーごとのレート上限)
+os.environ["APP_CACHE_DIR"] = tempfile.mkdtemp(prefix="bank-bench-")
+os.environ.setdefault("GEMINI_RPM_PER_KEY", "100000")
+# streamlit run 以外から読み込んだ時の警告は計測と無関係なので出さない
+streamlit_config.get_config_options()
+streamlit_logger.set_log_level("error")
+warnings.filterwarnings("ignore", category=FutureWarning)
+warnings.filterwarnings("ignore", category=RuntimeWarning, module="duckduckgo_search")
+
+import app  # noqa: E402
+from stubs import (  # noqa: E402
+    BankSiteServer,
+    FakeBrowser,
+    FakeDDGS,
+    FakeGemini,
+    Faults,
+    InMemorySheetConnection,
+    InMemoryWorksheet,
+    Latency,
+    bench_bank_name,
+)
+
+BASELINE_FILE = os.path.join(HERE, "baseline.json")
+SCENARIOS = ["dynamic", "smart_cold", "smart_warm", "bulk"]
+BENCH_KEYS = ["bench-key-1", "bench-key-2", "bench-key-3", "bench-key-4"]
+# 件数が少ないと p95 は1回の揺れで動くので、比較では差をこの秒数まで許す
+ABSOLUTE_SLACK = 0.05
+
+
+class StageRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+
+        return timed
+
+    def summary(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": len(values),
+                    "p50": round(percentile(values, 50), 4),
+                    "p95": round(percentile(values, 95), 4),
+                }
+                for stage, values in sorted(self.samples.items())
+            }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.site = BankSiteServer(Latency(args.page_latency)).start()
+        self.browser = FakeBrowser(
+            self.site, Latency(args.browser_latency), app.html_to_text
+        )
+        self.gemini = FakeGemini(
+            Latency(args.llm_latency, args.llm_error_rate),
+            args.seed,
+            garble_rate=args.llm_garble_rate,
+        )
+        FakeDDGS.site = self.site
+        FakeDDGS.latency = Latency(args.search_latency, args.search_error_rate)
+        self.recorder = None
+        self._install()
+        # 初回の接続確立を計測に含めない
+        app.get_http_session().get(self.site.bank_url(0), timeout=app.HTTP_TIMEOUT)
+
+    def _install(self):
+        # 関数はモジュールのグローバル名で呼ばれるので、app の属性を差し替えれば効く
+        app.API_KEYS = BENCH_KEYS
+        app.new_ddgs = FakeDDGS
+        app.KEY_COOLDOWN_BASE = self.args.cooldown
+        # ジョブは既定の並列数で呼ぶので、--workers はここで差し込む
+        app.refresh_banks_concurrently = functools.partial(
+            app.refresh_banks_concurrently, workers=self.args.workers
+        )
+        app.SEARCH_BACKOFF_BASE = self.args.cooldown
+        # 同じホストに全銀行を置くので、ドメインごとの待ち時間は測定から外す
+        throttle = app.DomainThrottle(0, 0)
+        app.get_domain_throttle = lambda: throttle
+        self._originals = {
+            name: getattr(app, name)
+            for name in [
+                "fetch_text_with_http",
+                "scrape_and_extract",
+                "generate_ultimate_rotation",
+                "sync_master_replica",
+            ]
+        }
+        self._search_run = app.WebSearchClient._run
+
+    def _fresh_state(self, workdir):
+        # 計測ごとにキャッシュ・キー状態・複製を作り直し、前の計測の結果を持ち越さない
+        workdir = tempfile.mkdtemp(dir=workdir)
+        recorder = StageRecorder()
+        # 失敗の注入もシナリオごとに同じ順序から始め、実行する組み合わせに左右されないようにする
+        FakeDDGS.faults = Faults(self.args.seed)
+        self.gemini.faults = Faults(self.args.seed)
+        scheduler = app.GeminiKeyScheduler(BENCH_KEYS, 100000)
+        scheduler.get_model = lambda key_state, model_name: self.gemini.model(
+            model_name
+        )
+        llm_cache = app.LLMResponseCache(
+            os.path.join(workdir, "llm_cache.sqlite3"), app.LLM_CACHE_MAX_BYTES
+        )
+        search = app.WebSearchClient()
+        replica = app.MasterReplica(os.path.join(workdir, "master.sqlite3"))
+        writer = app.SheetDiffWriter()
+        app.get_key_scheduler = lambda: scheduler
+        app.get_llm_cache = lambda: llm_cache
+        app.get_web_search = lambda: search
+        app.get_master_replica = lambda: replica
+        app.get_sheet_writer = lambda worksheet_id: writer
+
+        for name, fn in self._originals.items():
+            stage = {
+                "fetch_text_with_http": "http",
+                "scrape_and_extract": "extract",
+                "generate_ultimate_rotation": "llm",
+                "sync_master_replica": "sheet",
+            }[name]
+            setattr(app, name, recorder.wrap(stage, fn))
+        app.run_selenium_and_extract = recorder.wrap("browser", self.browser.run)
+        app.WebSearchClient._run = recorder.wrap("search", self._search_run)
+        self.recorder = recorder
+        return replica
+
+    def master_rows(self, count):
+        # 2/3 はURL登録済み、残りは検索からURLを探す
+        return [
+            {
+                **{c: "" for c in app.COLS},
+                "金融機関名": bench_bank_name(i),
+                "WebサイトURL": self.site.bank_url(i) if i % 3 else "",
+            }
+            for i in range(count)
+        ]
+
+    def run_scenario(self, scenario, count):
+        with tempfile.TemporaryDirectory(prefix="bank-bench-") as workdir:
+            replica = self._fresh_state(workdir)
+            rows = self.master_rows(count)
+            statuses = Counter()
+            if scenario == "smart_warm":
+                # 1回目の結果 (ハッシュ・ETag) を持った状態から、2回目だけを測る
+                for row in rows:
+                    data, _ = self._smart(row)
+                    row.update({k: v for k, v in (data or {}).items() if k in app.COLS})
+                replica = self._fresh_state(workdir)
+            llm_calls, browser_pages = self.gemini.calls, self.browser.pages
+            started = time.perf_counter()
+            if scenario == "bulk":
+                statuses = self._bulk(replica, rows, workdir)
+            else:
+                for row in rows:
+                    bank_started = time.perf_counter()
+                    if scenario == "dynamic":
+                        _, status = app.fetch_bank_data_dynamic(row["金融機関名"])
+                    else:
+                        _, status = self._smart(row)
+                    self.recorder.add("bank", time.perf_counter() - bank_started)
+                    statuses[status] += 1
+            elapsed = time.perf_counter() - started
+        extracted = max(1, sum(statuses.get(s, 0) for s in app.EXTRACTED_STATUSES))
+        return {
+            "banks": count,
+            "seconds": round(elapsed, 3),
+            "throughput": round(count / elapsed, 2),
+            "statuses": dict(statuses),
+            "per_success": {
+                "llm_calls": round((self.gemini.calls - llm_calls) / extracted, 2),
+                "browser_pages": round(
+                    (self.browser.pages - browser_pages) / extracted, 2
+                ),
+            },
+            "stages": self.recorder.summary(),
+        }
+
+    def _smart(self, row):
+        url = row["WebサイトURL"]
+        return app.update_bank_data_smart(
+            row["金融機関名"], url, prev=row, log=lambda *_: None
+        )
+
+    def _bulk(self, replica, rows, workdir):
+        # 管理画面と同じ BulkRefreshJobs を動かす (途中保存・差分書き込みも計測に入る)
+        worksheet = InMemoryWorksheet(
+            app.SheetDiffWriter.to_grid(app.pd.DataFrame(rows, columns=app.COLS)),
+            Latency(self.args.sheet_latency),
+        )
+        conn = InMemorySheetConnection(worksheet)
+        app.sync_master_replica(replica, conn)
+        jobs = app.BulkRefreshJobs(
+            os.path.join(workdir, "jobs.sqlite3"),
+            replica,
+            lambda: app.sync_master_replica(replica, conn),
+        )
+        job_id = jobs.start()
+        jobs._threads[job_id].join()
+        job = jobs.latest_job()
+        if job["status"] != "completed":
+            raise RuntimeError(
+                f"一括更新ジョブが {job['status']} で終了: {job['error']}"
+            )
+        return Counter(stat for _, stat, _, _ in jobs._items(job_id))
+
+    def close(self):
+        self.site.stop()
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, current in results.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        if current["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: throughput {before['throughput']} -> {current['throughput']}"
+            )
+        for stage, stats in current["stages"].items():
+            old = before["stages"].get(stage)
+            if old and stats["p95"] > old["p95"] * (1 + tolerance) + ABSOLUTE_SLACK:
+                regressions.append(
+                    f"{key}: {stage} p95 {old['p95']}s -> {stats['p95']}s"
+                )
+        for name, value in current.get("per_success", {}).items():
+            old_value = before.get("per_success", {}).get(name)
+            if old_value is not None and value > old_value * (1 + tolerance) + 0.01:
+                regressions.append(f"{key}: 1件あたり {name} {old_value} -> {value}")
+        extracted = sum(current["statuses"].get(s, 0) for s in ["Success", "Fallback"])
+        extracted_before = sum(
+            before["statuses"].get(s, 0) for s in ["Success", "Fallback"]
+        )
+        if extracted < extracted_before * (1 - tolerance):
+            regressions.append(f"{key}: 取得成功 {extracted_before} -> {extracted}")
+    return regressions
+
+
+def print_report(results):
+    for key, result in results.items():
+        statuses = ", ".join(f"{k}={v}" for k, v in sorted(result["statuses"].items()))
+        per_success = ", ".join(
+            f"{k}={v}" for k, v in result.get("per_success", {}).items()
+        )
+        print(
+            f"\n[{key}] {result['banks']}件 {result['seconds']}秒 "
+            f"({result['throughput']}件/秒) {statuses}"
+        )
+        print(f"  取得1件あたり: {per_success}")
+        print(f"  {'stage':<10}{'count':>7}{'p50(s)':>10}{'p95(s)':>10}")
+        for stage, stats in result["stages"].items():
+            print(
+                f"  {stage:<10}{stats['count']:>7}{stats['p50']:>10.4f}"
+                f"{stats['p95']:>10.4f}"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="銀行マスタ更新のオフラインベンチマーク"
+    )
+    parser.add_argument("--banks", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--workers", type=int, default=app.BULK_WORKERS)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.05)
+    parser.add_argument("--llm-garble-rate", type=float, default=0.1)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--search-error-rate", type=float, default=0.02)
+    parser.add_argument("--page-latency", type=float, default=0.03)
+    parser.add_argument("--browser-latency", type=float, default=0.5)
+    parser.add_argument("--sheet-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--cooldown",
+        type=float,
+        default=0.05,
+        help="429後のキー休止・検索再試行の基準秒",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--json", help="結果をJSONで書き出すパス")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    bench = Bench(args)
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            for count in args.banks:
+                key = f"{scenario}@{count}"
+                print(f"計測中: {key}", file=sys.stderr)
+                results[key] = bench.run_scenario(scenario, count)
+    finally:
+        bench.close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nベースラインを保存しました: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("\nベースラインがありません (--save-baseline で作成)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n⚠️ ベースラインより悪化 (許容 {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\nベースラインとの差は許容範囲内です。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
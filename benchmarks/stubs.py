@@ -0,0 +1,376 @@
+# ベンチマーク用の外部サービス代役 (Gemini / DuckDuckGo / 銀行サイト / Google Sheets / Chrome)
+# どれも遅延とエラー率を指定でき、ネットワークには一切出ない
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from duckduckgo_search.exceptions import DuckDuckGoSearchException, RatelimitException
+from google.api_core import exceptions as google_exceptions
+from gspread.utils import a1_to_rowcol
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+# 銀行番号ごとに使う録画ページ。spa は本文がJSで描画されるのでブラウザ経由になる
+PAGE_TEMPLATES = ["static_a.html", "static_b.html", "spa.html"]
+RENDERED_TEMPLATE = "static_b.html"
+BANK_NUMBER = re.compile(r"ベンチ銀行(\d+)")
+
+
+def bench_bank_name(i):
+    return f"ベンチ銀行{i:04d}"
+
+
+def bench_phone(i):
+    return f"0120-{i // 1000 % 1000:03d}-{i % 1000:03d}"
+
+
+@dataclass
+class Latency:
+    seconds: float = 0.0
+    error_rate: float = 0.0
+
+
+class Faults:
+    # スレッドをまたいでも同じシードなら同じ順で失敗させる
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def hit(self, rate):
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+
+# ------------------------------------------------------------
+# 銀行サイト (録画ページを返すローカルHTTPサーバー)
+# ------------------------------------------------------------
+
+
+class BankSiteServer:
+    def __init__(self, latency, pages_dir=PAGES_DIR):
+        self.latency = latency
+        self.templates = {}
+        for name in set(PAGE_TEMPLATES + [RENDERED_TEMPLATE]):
+            with open(os.path.join(pages_dir, name), encoding="utf-8") as f:
+                self.templates[name] = f.read()
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def bank_url(self, i):
+        return f"{self.base_url}/bank/{i}"
+
+    def render(self, i, rendered=False):
+        name = PAGE_TEMPLATES[i % len(PAGE_TEMPLATES)]
+        if rendered and name == "spa.html":
+            name = RENDERED_TEMPLATE
+        return self.templates[name].format(
+            bank=bench_bank_name(i), phone=bench_phone(i)
+        )
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.latency.seconds)
+                url = urlparse(self.path)
+                match = re.fullmatch(r"/bank/(\d+)", url.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                rendered = "rendered" in parse_qs(url.query)
+                body = server.render(int(match.group(1)), rendered).encode("utf-8")
+                etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakeBrowser:
+    # Chrome の代わり: 描画後の本文を返すまでに起動・描画分の遅延を入れる
+    def __init__(self, site, latency, html_to_text):
+        self.site = site
+        self.latency = latency
+        self.html_to_text = html_to_text
+        self.pages = 0
+
+    def run(self, target_url):
+        time.sleep(self.latency.seconds)
+        match = re.search(r"/bank/(\d+)", target_url)
+        if not match:
+            return None, "Access Error"
+        self.pages += 1
+        return self.html_to_text(self.site.render(int(match.group(1)), True)), "Success"
+
+
+# ------------------------------------------------------------
+# DuckDuckGo
+# ------------------------------------------------------------
+
+
+class FakeDDGS:
+    # WebSearchClient は new_ddgs() で作るので、クラスごと差し替える
+    site = None
+    latency = Latency()
+    faults = Faults(0)
+    calls = 0
+
+    def __init__(self, timeout=None, **kwargs):
+        pass
+
+    def text(self, query, max_results=3):
+        cls = FakeDDGS
+        cls.calls += 1
+        time.sleep(cls.latency.seconds)
+        if cls.faults.hit(cls.latency.error_rate):
+            raise DuckDuckGoSearchException(RatelimitException("bench 202 Ratelimit"))
+        match = BANK_NUMBER.search(query)
+        if not match:
+            return []
+        i = int(match.group(1))
+        topic = query.replace(match.group(0), "").strip()
+        return [
+            {
+                "href": cls.site.bank_url(i),
+                "title": f"{bench_bank_name(i)} 相続のお手続き",
+                "body": f"{bench_bank_name(i)} {topic}: 相続センター {bench_phone(i)} "
+                "までご連絡ください。残高証明書・取引明細の発行は来店予約制です。",
+            }
+        ][:max_results]
+
+
+# ------------------------------------------------------------
+# Gemini
+# ------------------------------------------------------------
+
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeContent:
+    def __init__(self, parts):
+        self.parts = parts
+
+
+class FakeCandidate:
+    def __init__(self, text):
+        self.content = FakeContent([FakePart(text)] if text else [])
+
+
+class FakeChunk:
+    # アプリは candidates[0].content.parts から読む (終了理由だけのチャンクは parts が空)
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [FakeCandidate(text)]
+
+
+class FakeGeminiModel:
+    def __init__(self, gemini, model_name):
+        self.gemini = gemini
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        chunks = self.gemini.respond(prompt, generation_config)
+        if stream:
+            return self.gemini.stream(chunks)
+        time.sleep(self.gemini.latency.seconds)
+        return FakeChunk("".join(chunks))
+
+
+class FakeGemini:
+    ERRORS = [
+        lambda: google_exceptions.TooManyRequests("bench quota"),
+        lambda: google_exceptions.ServiceUnavailable("bench unavailable"),
+    ]
+
+    ANSWERS = {
+        "freeze_method": "相続センターへ電話で連絡",
+        "balance_cert": "窓口または郵送で申請",
+        "transaction_history": "窓口で申請 (手数料あり)",
+        "cancellation": "相続手続依頼書を提出",
+        "investment": "記載なし",
+        "safe_deposit": "来店予約のうえ開扉",
+        "summary": "ベンチマーク用の応答",
+    }
+
+    def __init__(self, latency, seed, chunks=4, garble_rate=0.0):
+        # garble_rate: JSON応答の項目を欠けさせる・途中で切る割合 (聞き直しの計測用)
+        self.latency = latency
+        self.garble_rate = garble_rate
+        self.faults = Faults(seed)
+        self.chunks = chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def model(self, model_name):
+        return FakeGeminiModel(self, model_name)
+
+    def respond(self, prompt, generation_config=None):
+        with self._lock:
+            self.calls += 1
+            fail = self.faults.hit(self.latency.error_rate)
+            error = self.ERRORS[self.calls % len(self.ERRORS)]() if fail else None
+            garble = self.faults.hit(self.garble_rate)
+        if error is not None:
+            time.sleep(self.latency.seconds / 4)
+            raise error
+        if "JSON" in prompt:
+            phone = re.search(r"0\d{1,4}-\d{1,4}-\d{3,4}", prompt)
+            answers = {
+                "contact_phone": phone.group(0) if phone else "記載なし",
+                **self.ANSWERS,
+            }
+            schema = (generation_config or {}).get("response_schema") or {}
+            fields = list(schema.get("properties") or answers)
+            data = {f: answers.get(f, "") for f in fields}
+            if garble:
+                for f in fields[::2]:
+                    del data[f]
+            text = json.dumps(data, ensure_ascii=False)
+            if garble and self.calls % 2:
+                # 途中で切れたJSON (パースできない応答)
+                text = text[: len(text) * 2 // 3]
+        else:
+            text = "- 相続センターへ連絡\n- 必要書類を郵送\n- 完了まで約2週間"
+        size = max(1, len(text) // self.chunks)
+        return [text[i : i + size] for i in range(0, len(text), size)]
+
+    def stream(self, chunks):
+        for chunk in chunks:
+            time.sleep(self.latency.seconds / len(chunks))
+            yield FakeChunk(chunk)
+        yield FakeChunk("")
+
+
+# ------------------------------------------------------------
+# Google Sheets
+# ------------------------------------------------------------
+
+
+class InMemoryDriveClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def get_file_drive_metadata(self, spreadsheet_id):
+        time.sleep(self.worksheet.latency.seconds)
+        return {"modifiedTime": str(self.worksheet.revision)}
+
+
+class InMemoryWorksheet:
+    # gspread.Worksheet のうちアプリが使うメソッドだけを持つ
+    id = 0
+    spreadsheet_id = "bench"
+
+    def __init__(self, values, latency):
+        self.rows = [list(row) for row in values]
+        self.col_count = max((len(row) for row in self.rows), default=0)
+        self.latency = latency
+        self.revision = 0
+        self.api_calls = 0
+        self.client = InMemoryDriveClient(self)
+
+    def _call(self, changed=False):
+        self.api_calls += 1
+        time.sleep(self.latency.seconds)
+        if changed:
+            self.revision += 1
+
+    def _cell(self, r, c, value):
+        while len(self.rows) < r:
+            self.rows.append([])
+        row = self.rows[r - 1]
+        while len(row) < c:
+            row.append("")
+        row[c - 1] = value
+
+    def _range(self, a1):
+        start, _, end = a1.partition(":")
+        return a1_to_rowcol(start), a1_to_rowcol(end or start)
+
+    def get_all_values(self):
+        self._call()
+        width = max((len(row) for row in self.rows), default=0)
+        return [row + [""] * (width - len(row)) for row in self.rows]
+
+    def add_cols(self, count):
+        self._call(changed=True)
+        self.col_count += count
+
+    def batch_update(self, data, value_input_option=None):
+        self._call(changed=True)
+        for item in data:
+            (r1, c1), _ = self._range(item["range"])
+            for dr, row in enumerate(item["values"]):
+                for dc, value in enumerate(row):
+                    self._cell(r1 + dr, c1 + dc, value)
+
+    def batch_clear(self, ranges):
+        self._call(changed=True)
+        for a1 in ranges:
+            (r1, c1), (r2, c2) = self._range(a1)
+            for r in range(r1, min(r2, len(self.rows)) + 1):
+                for c in range(c1, min(c2, len(self.rows[r - 1])) + 1):
+                    self.rows[r - 1][c - 1] = ""
+
+    def append_rows(self, rows, **kwargs):
+        self._call(changed=True)
+        while self.rows and not any(self.rows[-1]):
+            self.rows.pop()
+        self.rows.extend(list(row) for row in rows)
+
+
+class InMemorySheetConnection:
+    # SheetConnection と同じく call(fn) でワークシートを渡す
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.reconnects = 0
+
+    def call(self, fn):
+        return fn(self.worksheet)
+
+    def age_seconds(self):
+        return 0
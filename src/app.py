@@ -1,23 +1,39 @@
+import atexit
+import datetime
+import hashlib
+import importlib
 import json
+import math
 import os
 import random
 import re
 import shutil
+import sqlite3
+import sys
+import threading
 import time
-
-import google.generativeai as genai
-import gspread
-import pandas as pd
-import streamlit as st
-import streamlit.components.v1 as components
-from dotenv import load_dotenv
-from duckduckgo_search import DDGS
-from gspread_dataframe import set_with_dataframe
-from oauth2client.service_account import ServiceAccountCredentials
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+import unicodedata
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# 起動時間の計測用 (外部ライブラリの import から、ページを描き終えるまでを測る)
+SCRIPT_STARTED = time.monotonic()
+
+import pandas as pd  # noqa: E402
+import requests  # noqa: E402
+import streamlit as st  # noqa: E402
+import streamlit.components.v1 as components  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+from urllib3.util.retry import Retry  # noqa: E402
+
+IMPORTS_FINISHED = time.monotonic()
 
 # ============================================================
 # ★設定エリア
@@ -38,34 +54,704 @@ MODEL_CANDIDATES = [
     "models/gemini-2.5-flash-lite",
     "models/gemini-2.5-flash",
 ]
-current_key_index = 0
 
 
-def configure_genai():
-    global current_key_index
-    if API_KEYS and current_key_index < len(API_KEYS):
-        genai.configure(api_key=API_KEYS[current_key_index])
+# ============================================================
+# ★ 遅延読み込み (重いライブラリは初めて使う時に読み込む)
+# ============================================================
+
+
+@st.cache_resource
+def get_startup_report():
+    # プロセス全体で1つ。初回描画までの時間と、遅延読み込みにかかった時間
+    return {"first_render": None, "last_rerun": None, "imports": {}}
+
+
+def load_module(name):
+    # 読み込み済みなら sys.modules から返すだけ。初回だけ時間を記録する
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.monotonic()
+    module = importlib.import_module(name)
+    elapsed = time.monotonic() - started
+    get_startup_report()["imports"].setdefault(name, round(elapsed, 3))
+    get_metrics().observe("startup.import", elapsed, module=name)
+    return module
+
+
+def record_script_run():
+    # プロセスで最初の描画は起動時間、2回目以降は再実行時間として数える
+    elapsed = time.monotonic() - SCRIPT_STARTED
+    report = get_startup_report()
+    if report["first_render"] is None:
+        report["first_render"] = round(elapsed, 3)
+        get_metrics().observe("startup.first_render", elapsed)
+        # 先頭で読み込む pandas / streamlit / requests の分 (初回だけ実際に読み込む)
+        eager = IMPORTS_FINISHED - SCRIPT_STARTED
+        report["imports"] = {"起動時の import": round(eager, 3), **report["imports"]}
+        get_metrics().observe("startup.import", eager, module="eager")
+    else:
+        report["last_rerun"] = round(elapsed, 3)
+        get_metrics().observe("script.rerun", elapsed)
+
+
+# ============================================================
+# ★ APIキー スケジューラ (レート制限・クールダウン)
+# ============================================================
+
+# 無料枠の目安 (1キーあたり/分)。超えそうなら別のキーに回す
+GEMINI_RPM_PER_KEY = float(os.getenv("GEMINI_RPM_PER_KEY", "15"))
+KEY_COOLDOWN_BASE = 30
+KEY_COOLDOWN_MAX = 600
+KEY_WAIT_TIMEOUT = 30
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class ApiKeyState:
+    def __init__(self, index, api_key, rpm):
+        self.index = index
+        self.api_key = api_key
+        self.bucket = TokenBucket(rpm / 60, max(1.0, rpm / 4))
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.total_latency = 0.0
+        self.client = None
+        self.models = {}
+
+
+class GeminiModel:
+    # 1つのキーのクライアントでモデルを呼ぶ。genai.configure はプロセス全体の設定で
+    # キーごとに分けられないので、生成APIのリクエストを直接組み立てる
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        glm = load_module("google.ai.generativelanguage")
+        request = glm.GenerateContentRequest(
+            model=f"models/{self.model_name}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=glm.GenerationConfig(generation_config or {}),
+        )
+        if stream:
+            return self.client.stream_generate_content(request)
+        return self.client.generate_content(request)
+
+
+class GeminiKeyScheduler:
+    def __init__(self, api_keys, rpm):
+        self._lock = threading.Lock()
+        self._keys = [ApiKeyState(i, k, rpm) for i, k in enumerate(api_keys)]
+        self._model_down = {}
+
+    def acquire(self, exclude=(), timeout=KEY_WAIT_TIMEOUT):
+        # 空いているキーの中から、処理中が少なく残りトークンが多いものを選ぶ
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                usable = [k for k in self._keys if k.index not in exclude]
+                if not usable:
+                    return None
+                ready = [k for k in usable if k.cooldown_until <= now]
+                ready.sort(key=lambda k: (k.in_flight, -k.bucket.wait_time(now)))
+                for key_state in ready:
+                    if key_state.bucket.try_take(now):
+                        key_state.in_flight += 1
+                        return key_state
+                wait = min(
+                    max(k.cooldown_until - now, k.bucket.wait_time(now)) for k in usable
+                )
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(min(wait, 1.0))
+
+    def release(self, key_state):
+        with self._lock:
+            key_state.in_flight -= 1
+
+    def is_model_down(self, key_state, model_name):
+        return self._model_down.get((key_state.index, model_name), 0) > time.monotonic()
+
+    def get_model(self, key_state, model_name):
+        # キーごとに GenerativeServiceClient を1つ持ち、モデル名ごとに包んで返す
+        with self._lock:
+            model = key_state.models.get(model_name)
+            if model is None:
+                if key_state.client is None:
+                    glm = load_module("google.ai.generativelanguage")
+                    key_state.client = glm.GenerativeServiceClient(
+                        client_options={"api_key": key_state.api_key}
+                    )
+                model = GeminiModel(key_state.client, model_name)
+                key_state.models[model_name] = model
+            return model
+
+    def record_success(self, key_state, latency):
+        with self._lock:
+            key_state.calls += 1
+            key_state.total_latency += latency
+            key_state.consecutive_throttles = 0
+
+    def record_error(self, key_state, model_name, error, latency):
+        # 戻り値: "throttled" / "key" はキーを替える、"model" / "other" は次のモデルへ
+        google_exceptions = load_module("google.api_core.exceptions")
+        with self._lock:
+            now = time.monotonic()
+            key_state.calls += 1
+            key_state.errors += 1
+            key_state.total_latency += latency
+            if isinstance(error, google_exceptions.TooManyRequests):
+                key_state.throttled += 1
+                key_state.consecutive_throttles += 1
+                backoff = KEY_COOLDOWN_BASE * 2 ** (key_state.consecutive_throttles - 1)
+                key_state.cooldown_until = now + min(backoff, KEY_COOLDOWN_MAX)
+                return "throttled"
+            if isinstance(
+                error,
+                (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated),
+            ) or (
+                isinstance(error, google_exceptions.InvalidArgument)
+                and "API key" in str(error)
+            ):
+                key_state.cooldown_until = now + KEY_COOLDOWN_MAX
+                return "key"
+            if isinstance(error, google_exceptions.NotFound):
+                self._model_down[(key_state.index, model_name)] = now + KEY_COOLDOWN_MAX
+                return "model"
+            return "other"
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "キー": f"#{k.index + 1} (...{k.api_key[-4:]})",
+                    "呼出": k.calls,
+                    "エラー": k.errors,
+                    "429": k.throttled,
+                    "平均応答(秒)": (
+                        round(k.total_latency / k.calls, 2) if k.calls else 0
+                    ),
+                    "処理中": k.in_flight,
+                    "クールダウン残(秒)": max(0, int(k.cooldown_until - now)),
+                }
+                for k in self._keys
+            ]
+
+
+@st.cache_resource
+def get_key_scheduler():
+    return GeminiKeyScheduler(
+        [k.strip() for k in API_KEYS if k.strip()], GEMINI_RPM_PER_KEY
+    )
+
+
+# ============================================================
+# ★ LLM応答キャッシュ (SQLite / 再起動後も有効)
+# ============================================================
+
+CACHE_DIR = os.getenv("APP_CACHE_DIR", ".cache")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class LLMResponseCache:
+    def __init__(self, path, max_bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                expires_at REAL,
+                last_access REAL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)"
+        )
+
+    @staticmethod
+    def make_key(key_text):
+        # モデル候補が変わったら別キャッシュ扱い
+        raw = "\n".join(MODEL_CANDIDATES) + "\0" + key_text
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key_text):
+        key = self.make_key(key_text)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key_text, model_name, response, ttl=LLM_CACHE_TTL):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.make_key(key_text),
+                    model_name,
+                    response,
+                    size,
+                    now,
+                    now + ttl,
+                    now,
+                ),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 最後に使われたのが古い順に消す (LRU)
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total,
+            }
+
+
+@st.cache_resource
+def get_llm_cache():
+    return LLMResponseCache(
+        os.path.join(CACHE_DIR, "llm_cache.sqlite3"), LLM_CACHE_MAX_BYTES
+    )
+
+
+# 途中で失敗して別のキー/モデルでやり直す時に流す目印 (受け手は表示中の文章を捨てる)
+STREAM_RESET = object()
+# 生成できなかった時の目印。このあとに画面表示用のエラー文が続く
+STREAM_FAILED = object()
 
 
-configure_genai()
+def chunk_text(chunk):
+    # 終了理由だけのチャンクは parts が空で .text が例外になるので、parts から読む
+    candidates = chunk.candidates
+    if not candidates:
+        return ""
+    return "".join(part.text for part in candidates[0].content.parts)
 
 
-def generate_ultimate_rotation(prompt):
-    global current_key_index
+def stream_ultimate_rotation(
+    prompt,
+    use_cache=True,
+    cache_key=None,
+    ttl=LLM_CACHE_TTL,
+    key_timeout=KEY_WAIT_TIMEOUT,
+    generation_config=None,
+):
+    # use_cache=False は強制再取得 (読まずに呼び、結果はキャッシュを上書き)
     if not API_KEYS:
-        return "エラー: APIキーが見つかりません。.envファイルを確認してください。"
+        yield STREAM_FAILED
+        yield "エラー: APIキーが見つかりません。.envファイルを確認してください。"
+        return
+
+    cache = get_llm_cache()
+    cache_key = cache_key or prompt
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    scheduler = get_key_scheduler()
+    tried = set()
+    while True:
+        with span("llm.key_wait"):
+            key_state = scheduler.acquire(exclude=tried, timeout=key_timeout)
+        if key_state is None:
+            break
+        tried.add(key_state.index)
+        try:
+            for model_name in MODEL_CANDIDATES:
+                if scheduler.is_model_down(key_state, model_name):
+                    continue
+                started = time.monotonic()
+                parts = []
+                try:
+                    response = scheduler.get_model(
+                        key_state, model_name
+                    ).generate_content(
+                        prompt, generation_config=generation_config, stream=True
+                    )
+                    for chunk in response:
+                        text = chunk_text(chunk)
+                        if text:
+                            parts.append(text)
+                            yield text
+                    if not parts:
+                        # 候補なし (ブロック等) は従来の response.text と同じく失敗扱い
+                        raise ValueError("応答が空です")
+                except Exception as e:
+                    elapsed = time.monotonic() - started
+                    kind = scheduler.record_error(key_state, model_name, e, elapsed)
+                    get_metrics().observe(
+                        "llm.call",
+                        elapsed,
+                        ok=False,
+                        model=model_name,
+                        key=key_state.index,
+                        error=kind,
+                    )
+                    if parts:
+                        yield STREAM_RESET
+                    if kind in ("throttled", "key"):
+                        break
+                    continue
+                elapsed = time.monotonic() - started
+                scheduler.record_success(key_state, elapsed)
+                get_metrics().observe(
+                    "llm.call", elapsed, model=model_name, key=key_state.index
+                )
+                cache.put(cache_key, model_name, "".join(parts), ttl)
+                return
+        finally:
+            scheduler.release(key_state)
+    yield STREAM_FAILED
+    yield "エラー: 生成失敗"
+
+
+def collect_stream(chunks):
+    parts = []
+    for chunk in chunks:
+        if chunk is STREAM_RESET:
+            parts = []
+        elif chunk is not STREAM_FAILED:
+            parts.append(chunk)
+    return "".join(parts)
+
+
+def generate_ultimate_rotation(
+    prompt,
+    use_cache=True,
+    cache_key=None,
+    ttl=LLM_CACHE_TTL,
+    key_timeout=KEY_WAIT_TIMEOUT,
+    generation_config=None,
+):
+    # 生成できなかった時はエラー文ではなく None を返す
+    with span("llm"):
+        chunks = list(
+            stream_ultimate_rotation(
+                prompt, use_cache, cache_key, ttl, key_timeout, generation_config
+            )
+        )
+    if any(chunk is STREAM_FAILED for chunk in chunks):
+        return None
+    return collect_stream(chunks)
+
+
+# ============================================================
+# ★ 計測 (段階ごとの所要時間・銀行ごとのコスト)
+# ============================================================
 
-    for _ in range(len(API_KEYS)):
-        for model_name in MODEL_CANDIDATES:
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SPAN_LOG_FILE = os.path.join(CACHE_DIR, "spans.jsonl")
+SPAN_LOG_MAX_BYTES = 5 * 1024 * 1024
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+METRICS_MAX_BANKS = 500
+# 銀行ごとのコスト表で回数を数える段階
+BANK_COST_STAGES = {
+    "llm.call": "LLM呼出",
+    "search.engine": "検索",
+    "browser.load": "ブラウザ",
+}
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, ok):
+        self.count += 1
+        self.total += seconds
+        self.errors += 0 if ok else 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def quantile(self, q):
+        # ヒストグラムからの概算 (該当バケットの上限を返す)
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS + [math.inf], self.buckets):
+            seen += n
+            if n and seen >= target:
+                return bound
+        return 0
+
+
+class PipelineMetrics:
+    def __init__(self, log_path):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages = defaultdict(StageStats)
+        self.outcomes = defaultdict(int)
+        self.banks = {}
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        self._log_path = log_path
+        self._log_lock = threading.Lock()
+
+    def _write_log(self, record):
+        # 1行1JSON。大きくなったら1世代だけ残して切り替える
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._log_lock:
             try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
-                return response.text
-            except Exception:
-                continue
-        current_key_index = (current_key_index + 1) % len(API_KEYS)
-        configure_genai()
-    return "エラー: 生成失敗"
+                if os.path.getsize(self._log_path) > SPAN_LOG_MAX_BYTES:
+                    os.replace(self._log_path, self._log_path + ".1")
+            except OSError:
+                pass
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def observe(self, stage, seconds, ok=True, **fields):
+        bank = getattr(self._local, "bank", None)
+        with self._lock:
+            self.stages[stage].add(seconds, ok)
+            if bank and stage in BANK_COST_STAGES:
+                self.banks[bank][BANK_COST_STAGES[stage]] += 1
+            if bank and fields.get("bytes"):
+                entry = self.banks[bank]
+                entry["転送KB"] = round(entry["転送KB"] + fields["bytes"] / 1024, 1)
+        self._write_log(
+            {
+                "ts": round(time.time(), 3),
+                "stage": stage,
+                "seconds": round(seconds, 4),
+                "ok": ok,
+                "bank": bank,
+                "thread": threading.current_thread().name,
+                **fields,
+            }
+        )
+
+    @contextmanager
+    def span(self, stage, **fields):
+        started = time.monotonic()
+        ok = True
+        try:
+            yield fields
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.observe(stage, time.monotonic() - started, ok, **fields)
+
+    @contextmanager
+    def bank(self, bank_name):
+        # この中で計測した段階は、この銀行のコストとして数える (入れ子は外側が持つ)
+        if getattr(self._local, "bank", None):
+            yield {}
+            return
+        result = {"status": "失敗"}
+        with self._lock:
+            entry = self.banks.pop(bank_name, None) or {
+                "銀行": bank_name,
+                "回数": 0,
+                "合計秒": 0.0,
+                **{label: 0 for label in BANK_COST_STAGES.values()},
+                "転送KB": 0.0,
+            }
+            self.banks[bank_name] = entry
+            while len(self.banks) > METRICS_MAX_BANKS:
+                self.banks.pop(next(iter(self.banks)))
+        self._local.bank = bank_name
+        started = time.monotonic()
+        try:
+            with self.span("bank") as span_fields:
+                yield result
+                span_fields["status"] = result["status"]
+        finally:
+            self._local.bank = None
+            with self._lock:
+                entry["回数"] += 1
+                entry["合計秒"] = round(entry["合計秒"] + time.monotonic() - started, 2)
+                entry["最終結果"] = result["status"]
+                self.outcomes[result["status"]] += 1
+
+    def stage_table(self):
+        with self._lock:
+            return [
+                {
+                    "段階": stage,
+                    "回数": s.count,
+                    "失敗": s.errors,
+                    "平均(秒)": round(s.total / s.count, 3) if s.count else 0,
+                    "p50(秒)": s.quantile(0.5),
+                    "p95(秒)": s.quantile(0.95),
+                    "合計(秒)": round(s.total, 1),
+                }
+                for stage, s in sorted(self.stages.items())
+            ]
+
+    def histogram(self, stage):
+        labels = [f"≤{b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        with self._lock:
+            counts = list(self.stages[stage].buckets) if stage in self.stages else []
+        return pd.DataFrame({"回数": counts or [0] * len(labels)}, index=labels)
+
+    def bank_table(self):
+        with self._lock:
+            return sorted(
+                (dict(entry) for entry in self.banks.values()),
+                key=lambda e: -e["合計秒"],
+            )
+
+    def outcome_rates(self):
+        with self._lock:
+            total = sum(self.outcomes.values())
+            return {
+                status: (n, n / total if total else 0)
+                for status, n in sorted(self.outcomes.items())
+            }
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP bank_stage_seconds Time spent per pipeline stage.",
+            "# TYPE bank_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, s in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS, s.buckets):
+                    cumulative += n
+                    lines.append(
+                        f'bank_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f'bank_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {s.count}'
+                )
+                lines.append(f'bank_stage_seconds_sum{{stage="{stage}"}} {s.total:.6f}')
+                lines.append(f'bank_stage_seconds_count{{stage="{stage}"}} {s.count}')
+            lines += [
+                "# HELP bank_stage_errors_total Failed spans per pipeline stage.",
+                "# TYPE bank_stage_errors_total counter",
+            ]
+            for stage, s in sorted(self.stages.items()):
+                lines.append(f'bank_stage_errors_total{{stage="{stage}"}} {s.errors}')
+            lines += [
+                "# HELP bank_refresh_outcomes_total Bank lookups by final status.",
+                "# TYPE bank_refresh_outcomes_total counter",
+            ]
+            for status, n in sorted(self.outcomes.items()):
+                lines.append(f'bank_refresh_outcomes_total{{status="{status}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource
+def get_metrics():
+    return PipelineMetrics(SPAN_LOG_FILE)
+
+
+def span(stage, **fields):
+    return get_metrics().span(stage, **fields)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_metrics().prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@st.cache_resource
+def start_metrics_server():
+    # METRICS_PORT を指定した時だけ /metrics を公開する (Prometheus から取得)
+    if not METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, daemon=True, name="metrics-http"
+    ).start()
+    return server
 
 
 # ============================================================
@@ -74,59 +760,584 @@ def generate_ultimate_rotation(prompt):
 
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1kQJ7j6jgs0RqS1IRvrdyuNseZ9GKgov5YXiDq-vawCc/edit?gid=0#gid=0"
 
+COLS = [
+    "金融機関名",
+    "WebサイトURL",
+    "電話番号",
+    "凍結方法",
+    "残高証明",
+    "取引明細",
+    "解約手続",
+    "投信国債",
+    "貸金庫",
+    "AI要約",
+    "最終更新",
+    "取得方式",
+    "コンテンツハッシュ",
+    "ETag",
+    "Last-Modified",
+]
 
-@st.cache_data(ttl=60)
-def get_google_sheet_data_cached():
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    json_file = "service_account.json"
 
-    if os.path.exists(json_file):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(json_file, scope)
-    else:
-        return None, None
+SERVICE_ACCOUNT_FILE = "service_account.json"
+SHEET_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+# 期限切れ直前のトークンで呼ばないよう、この秒数前に更新しておく
+CREDENTIAL_REFRESH_MARGIN = 300
+
+
+def is_reconnectable_error(error):
+    gspread = load_module("gspread")
+    google_auth_exceptions = load_module("google.auth.exceptions")
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response is not None and error.response.status_code == 401
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            google_auth_exceptions.TransportError,
+            google_auth_exceptions.RefreshError,
+        ),
+    )
 
-    client = gspread.authorize(creds)
-    try:
-        sheet = client.open_by_url(SHEET_URL)
-        worksheet = sheet.get_worksheet(0)
-        data = worksheet.get_all_values()
-        if not data:
-            return pd.DataFrame(), worksheet
-        headers = data.pop(0)
-        df = pd.DataFrame(data, columns=headers)
-        return df, worksheet
-    except:
-        return None, None
+
+class SheetConnection:
+    # 認証済みクライアントとワークシートをプロセスで1つだけ持つ
+    def __init__(self, json_file):
+        self.json_file = json_file
+        self.creds = None
+        self.client = None
+        self.worksheet = None
+        self.connected_at = None
+        self.reconnects = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        service_account = load_module("google.oauth2.service_account")
+        creds = service_account.Credentials.from_service_account_file(
+            self.json_file, scopes=SHEET_SCOPES
+        )
+        client = load_module("gspread").authorize(creds)
+        worksheet = client.open_by_url(SHEET_URL).get_worksheet(0)
+        self.creds, self.client, self.worksheet = creds, client, worksheet
+        self.connected_at = time.time()
+
+    def _refresh_if_expiring(self):
+        expiry = self.creds.expiry
+        if expiry is None:
+            return
+        remaining = expiry - datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        if remaining.total_seconds() < CREDENTIAL_REFRESH_MARGIN:
+            transport = load_module("google.auth.transport.requests")
+            self.creds.refresh(transport.Request())
+
+    def get_worksheet(self):
+        with self._lock:
+            if self.worksheet is None:
+                self._connect()
+            else:
+                self._refresh_if_expiring()
+            return self.worksheet
+
+    def reconnect(self):
+        with self._lock:
+            self.worksheet = None
+            self.reconnects += 1
+            self._connect()
+            return self.worksheet
+
+    def call(self, fn):
+        # 認証切れ・通信エラーなら1回だけ繋ぎ直してやり直す
+        try:
+            return fn(self.get_worksheet())
+        except Exception as e:
+            if not is_reconnectable_error(e):
+                raise
+        return fn(self.reconnect())
+
+    def age_seconds(self):
+        if self.connected_at is None:
+            return 0
+        return int(time.time() - self.connected_at)
+
+
+@st.cache_resource
+def get_sheet_connection():
+    return SheetConnection(SERVICE_ACCOUNT_FILE)
 
 
-def get_worksheet_object():
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive",
+def group_runs(indexes, gap=2):
+    # 近い変更列はまとめて1レンジにする (間の未変更セルも書き直す)
+    runs = []
+    for i in indexes:
+        if runs and i - runs[-1][1] <= gap:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return runs
+
+
+def diff_sheet_grid(old, new):
+    rowcol_to_a1 = load_module("gspread.utils").rowcol_to_a1
+    updates = []
+    for r, (prev, row) in enumerate(zip(old, new), start=1):
+        width = max(len(prev), len(row))
+        prev = prev + [""] * (width - len(prev))
+        row = row + [""] * (width - len(row))
+        changed = [c for c in range(width) if prev[c] != row[c]]
+        for start, end in group_runs(changed):
+            updates.append(
+                {
+                    "range": f"{rowcol_to_a1(r, start + 1)}:{rowcol_to_a1(r, end + 1)}",
+                    "values": [row[start : end + 1]],
+                }
+            )
+    appends = new[len(old) :]
+    clears = []
+    if len(old) > len(new):
+        width = max(len(row) for row in old[len(new) :])
+        clears.append(
+            f"{rowcol_to_a1(len(new) + 1, 1)}:{rowcol_to_a1(len(old), width)}"
+        )
+    return updates, appends, clears
+
+
+class SheetDiffWriter:
+    # 最後に書いた状態を覚えておき、変わったセルだけ送る (clear はしない)
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.last_stats = {}
+
+    @staticmethod
+    def to_grid(df):
+        header = [str(c) for c in df.columns]
+        return [header] + df.fillna("").astype(str).values.tolist()
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def reset(self, values):
+        with self._lock:
+            self._snapshot = [list(row) for row in values]
+
+    def save(self, worksheet, df):
+        grid = self.to_grid(df)
+        with self._lock:
+            try:
+                if self._snapshot is None:
+                    self._snapshot = worksheet.get_all_values()
+                updates, appends, clears = diff_sheet_grid(self._snapshot, grid)
+                cleared_rows = max(0, len(self._snapshot) - len(grid))
+                width = max(len(row) for row in grid)
+                if width > worksheet.col_count:
+                    worksheet.add_cols(width - worksheet.col_count)
+                if updates:
+                    worksheet.batch_update(updates, value_input_option="RAW")
+                if clears:
+                    worksheet.batch_clear(clears)
+                if appends:
+                    worksheet.append_rows(
+                        appends,
+                        value_input_option="RAW",
+                        insert_data_option="INSERT_ROWS",
+                        table_range="A1",
+                    )
+                self._snapshot = grid
+            except Exception:
+                # 途中で失敗したら次回はシートを読み直して差分を取り直す
+                self._snapshot = None
+                raise
+            self.last_stats = {
+                "ranges": len(updates),
+                "cells": sum(len(u["values"][0]) for u in updates),
+                "appended_rows": len(appends),
+                "cleared_rows": cleared_rows,
+            }
+            return self.last_stats
+
+
+@st.cache_resource
+def get_sheet_writer(worksheet_id):
+    return SheetDiffWriter()
+
+
+def sheet_last_update_time(worksheet):
+    # Drive のメタデータだけ取る (シート本体はダウンロードしない)
+    return worksheet.client.get_file_drive_metadata(worksheet.spreadsheet_id)[
+        "modifiedTime"
     ]
-    json_file = "service_account.json"
-    if os.path.exists(json_file):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(json_file, scope)
+
+
+# ============================================================
+# ★ マスタのローカル複製 (読み込みは常にここから)
+# ============================================================
+
+REPLICA_SYNC_INTERVAL = int(os.getenv("REPLICA_SYNC_INTERVAL", "30"))
+
+
+class MasterReplica:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._edit_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (pos INTEGER PRIMARY KEY, data TEXT)"
+        )
+        self.last_sync_at = None
+        self.last_error = ""
+
+    def _get_meta(self, key, default=""):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value))
+        )
+
+    def version(self):
+        with self._lock:
+            return int(self._get_meta("version", "0"))
+
+    def has_data(self):
+        with self._lock:
+            return self._get_meta("header", None) is not None
+
+    def is_pending(self):
+        with self._lock:
+            return self._get_meta("pending", "0") == "1"
+
+    def upstream_modified(self):
+        with self._lock:
+            return self._get_meta("upstream_modified")
+
+    def load_frame(self):
+        with self._lock:
+            header = json.loads(self._get_meta("header", "[]"))
+            rows = [
+                json.loads(data)
+                for (data,) in self._conn.execute("SELECT data FROM rows ORDER BY pos")
+            ]
+        if not header:
+            return pd.DataFrame()
+        return pd.DataFrame(rows, columns=header)
+
+    def _replace(self, grid, pending, upstream_modified=None):
+        header = grid[0] if grid else []
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.execute("DELETE FROM rows")
+            self._conn.executemany(
+                "INSERT INTO rows VALUES (?, ?)",
+                [
+                    (pos, json.dumps(row + [""] * (len(header) - len(row))))
+                    for pos, row in enumerate(grid[1:])
+                ],
+            )
+            self._set_meta("header", json.dumps(header))
+            self._set_meta("version", int(self._get_meta("version", "0")) + 1)
+            self._set_meta("pending", "1" if pending else "0")
+            if upstream_modified is not None:
+                self._set_meta("upstream_modified", upstream_modified)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def write_local(self, df):
+        with self._lock:
+            self._replace(SheetDiffWriter.to_grid(df), pending=True)
+            return int(self._get_meta("version"))
+
+    def update_frame(self, fn):
+        # 読み込みから書き戻しまでの間に、他スレッドの部分更新が割り込まないようにする
+        with self._edit_lock:
+            return self.write_local(fn(self.load_frame()))
+
+    def apply_upstream(self, values, modified, expected_version):
+        # 取得中にローカル書き込みがあった場合はそちらを優先して捨てる。
+        # update_frame の読み込み〜書き戻しの間には割り込まない (古い表で上書きされるため)
+        with self._edit_lock, self._lock:
+            if int(self._get_meta("version", "0")) != expected_version:
+                return False
+            if self._get_meta("pending", "0") == "1":
+                return False
+            self._replace(values, pending=False, upstream_modified=modified)
+            return True
+
+    def mark_pushed(self, pushed_version, modified):
+        with self._lock:
+            if int(self._get_meta("version", "0")) == pushed_version:
+                self._set_meta("pending", "0")
+            self._set_meta("upstream_modified", modified)
+
+
+@st.cache_resource
+def get_master_replica():
+    return MasterReplica(os.path.join(CACHE_DIR, "master.sqlite3"))
+
+
+def sync_master_replica(replica, conn):
+    # 未送信の変更があれば先に送る。なければ更新日時だけ見て、変わっていれば取り込む
+    if replica.is_pending():
+        version = replica.version()
+        df = replica.load_frame()
+        with span("sheet.check"):
+            remote_changed = (
+                conn.call(sheet_last_update_time) != replica.upstream_modified()
+            )
+        with span("sheet.write", rows=len(df)) as fields:
+            fields.update(conn.call(lambda ws: get_sheet_writer(ws.id).save(ws, df)))
+        # 送ったのは変えたセルだけなので、先にシート側で変わった分は次回取り込む
+        modified = "" if remote_changed else conn.call(sheet_last_update_time)
+        replica.mark_pushed(version, modified)
+        result = "pushed"
     else:
-        return None
+        version = replica.version()
+        with span("sheet.check"):
+            modified = conn.call(sheet_last_update_time)
+        if replica.has_data() and modified == replica.upstream_modified():
+            result = "unchanged"
+        else:
+            with span("sheet.read"):
+                values = conn.call(lambda ws: ws.get_all_values())
+            if replica.apply_upstream(values, modified, version):
+                conn.call(lambda ws: get_sheet_writer(ws.id).reset(values))
+            result = "pulled"
+    replica.last_sync_at = time.time()
+    replica.last_error = ""
+    return result
+
+
+@st.cache_resource
+def start_replica_sync():
+    replica = get_master_replica()
+    conn = get_sheet_connection()
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(REPLICA_SYNC_INTERVAL):
+            try:
+                sync_master_replica(replica, conn)
+            except Exception as e:
+                replica.last_error = str(e)
 
-    client = gspread.authorize(creds)
-    try:
-        sheet = client.open_by_url(SHEET_URL)
-        return sheet.get_worksheet(0)
-    except:
+    threading.Thread(target=loop, name="master-replica-sync", daemon=True).start()
+    return stop
+
+
+def compact_master_frame(df):
+    # 1セルごとの Python 文字列 (object 列) ではなく、Arrow の文字列列にまとめて持つ
+    return df.fillna("").astype(str).astype("string[pyarrow]")
+
+
+class MasterStore:
+    # 版ごとに1つ作り、全セッションで共有する読み取り専用のマスタ (書き換える時は .copy())
+    def __init__(self, df, version):
+        self.version = version
+        self.frame = compact_master_frame(df)
+        self.names = (
+            tuple(self.frame["金融機関名"]) if "金融機関名" in self.frame else ()
+        )
+        # 同名が複数あれば先頭の行を使う
+        self._rows = {}
+        for i, name in enumerate(self.names):
+            self._rows.setdefault(name, i)
+        self._search_index = None
+
+    def row(self, bank_name):
+        i = self._rows.get(bank_name)
+        if i is None:
+            return None
+        return self.frame.iloc[i].to_dict()
+
+    @property
+    def search_index(self):
+        if self._search_index is None:
+            self._search_index = get_bank_search_index(self.names)
+        return self._search_index
+
+
+@st.cache_resource(max_entries=2)
+def load_master_store(version):
+    return MasterStore(get_master_replica().load_frame(), version)
+
+
+def get_master_store():
+    replica = get_master_replica()
+    if os.path.exists(SERVICE_ACCOUNT_FILE):
+        start_replica_sync()
+        if not replica.has_data():
+            try:
+                sync_master_replica(replica, get_sheet_connection())
+            except Exception as e:
+                replica.last_error = str(e)
+    if not replica.has_data():
         return None
+    return load_master_store(replica.version())
+
 
+def get_master_data():
+    store = get_master_store()
+    return store.frame if store else None
 
-def save_to_google_sheet(worksheet, df):
+
+def save_master_data(df):
+    # ローカルに先に書き、シートへは続けて送る (失敗しても同期スレッドが再送する)
+    replica = get_master_replica()
+    replica.write_local(df)
+    if not os.path.exists(SERVICE_ACCOUNT_FILE):
+        return
     try:
-        worksheet.clear()
-        set_with_dataframe(worksheet, df)
+        sync_master_replica(replica, get_sheet_connection())
     except Exception as e:
-        st.warning(f"保存スキップ: {e}")
+        replica.last_error = str(e)
+        st.warning(f"シートへの反映を保留しました (自動で再送します): {e}")
+
+
+# ============================================================
+# ★ Web検索 (結果キャッシュ・同一クエリの集約)
+# ============================================================
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+SEARCH_EMPTY_TTL = 600
+SEARCH_CACHE_MAX_ENTRIES = 1024
+SEARCH_MAX_RESULTS = 3
+SEARCH_RETRIES = 3
+SEARCH_BACKOFF_BASE = 2.0
+SEARCH_TIMEOUT = 10
+
+
+def new_ddgs():
+    return load_module("duckduckgo_search").DDGS(timeout=SEARCH_TIMEOUT)
+
+
+def is_search_throttled(error):
+    # text() は全バックエンド失敗時に元の例外を包み直して投げてくる
+    errors = load_module("duckduckgo_search.exceptions")
+    throttled = (errors.RatelimitException, errors.TimeoutException)
+    return isinstance(error, throttled) or ("Ratelimit" in str(error))
+
+
+class WebSearchClient:
+    # トピックごとの検索は先読み (DetailPrefetch) のスレッドから並列に呼ばれる
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._inflight = {}
+        self._local = threading.local()
+        self.requests = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.searches = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    def _ddgs(self):
+        # DDGS はHTTPクライアントを抱えているのでスレッドごとに使い回す
+        ddgs = getattr(self._local, "ddgs", None)
+        if ddgs is None:
+            ddgs = new_ddgs()
+            self._local.ddgs = ddgs
+        return ddgs
+
+    def _run(self, query, max_results):
+        errors = load_module("duckduckgo_search.exceptions")
+        for attempt in range(SEARCH_RETRIES):
+            started = time.monotonic()
+            try:
+                results = self._ddgs().text(query, max_results=max_results) or []
+            except errors.DuckDuckGoSearchException as e:
+                elapsed = time.monotonic() - started
+                get_metrics().observe("search.engine", elapsed, ok=False, error=str(e))
+                with self._lock:
+                    self.searches += 1
+                    self.total_latency += elapsed
+                if not is_search_throttled(e) or attempt == SEARCH_RETRIES - 1:
+                    with self._lock:
+                        self.errors += 1
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(SEARCH_BACKOFF_BASE * 2**attempt + random.uniform(0, 1))
+                continue
+            elapsed = time.monotonic() - started
+            get_metrics().observe("search.engine", elapsed, results=len(results))
+            with self._lock:
+                self.searches += 1
+                self.total_latency += elapsed
+            return results
+
+    def search(self, query, max_results=SEARCH_MAX_RESULTS, refresh=False):
+        key = (" ".join(query.split()), max_results)
+        with self._lock:
+            self.requests += 1
+            entry = self._cache.get(key)
+            if not refresh and entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            # 同じクエリが実行中なら、その結果を待って受け取る
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            results = self._run(key[0], max_results)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        ttl = SEARCH_CACHE_TTL if results else SEARCH_EMPTY_TTL
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = (time.monotonic() + ttl, results)
+            while len(self._cache) > SEARCH_CACHE_MAX_ENTRIES:
+                self._cache.pop(next(iter(self._cache)))
+            self._inflight.pop(key, None)
+        future.set_result(results)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "searches": self.searches,
+                "retries": self.retries,
+                "errors": self.errors,
+                "avg_latency": (
+                    round(self.total_latency / self.searches, 2) if self.searches else 0
+                ),
+                "entries": len(self._cache),
+            }
+
+
+@st.cache_resource
+def get_web_search():
+    return WebSearchClient()
 
 
 # ============================================================
@@ -161,91 +1372,805 @@ USER_AGENTS = [
 
 
 def search_new_url_with_snippet(bank_name):
+    errors = load_module("duckduckgo_search.exceptions")
     try:
-        query = f"{bank_name} 相続手続き"
-        results = DDGS().text(query, max_results=3)
-        if results:
-            top_url = results[0]["href"]
-            combined_snippet = "\n".join(
-                [f"- {r.get('title', '')}: {r.get('body', '')}" for r in results]
-            )
-            return top_url, combined_snippet
-    except:
+        with span("search"):
+            results = get_web_search().search(f"{bank_name} 相続手続き")
+    except errors.DuckDuckGoSearchException:
         return None, None
+    if results:
+        top_url = results[0]["href"]
+        combined_snippet = "\n".join(
+            [f"- {r.get('title', '')}: {r.get('body', '')}" for r in results]
+        )
+        return top_url, combined_snippet
     return None, None
 
 
-def ask_gemini_to_extract_7points(text_data, is_html=True):
-    data_type = "HTML" if is_html else "テキスト"
-    prompt = f"""
-    行政書士の実務アシスタントとして、{data_type}から相続手続きの「7つの重要項目」を抽出してください。
-    JSON形式で出力し、情報がない場合は「記載なし」としてください。
-    {{
-        "contact_phone": "電話番号", "freeze_method": "凍結連絡方法",
-        "balance_cert": "残高証明申請", "transaction_history": "取引明細申請",
-        "cancellation": "解約手続", "investment": "投信・国債手続",
-        "safe_deposit": "貸金庫手続", "summary": "その他要約"
-    }}
+# ============================================================
+# ★ 本文の絞り込み (7項目に関係するブロックだけLLMに送る)
+# ============================================================
+
+EXTRACT_TOKEN_BUDGET = int(os.getenv("EXTRACT_TOKEN_BUDGET", "6000"))
+BLOCK_MAX_CHARS = 400
+
+TOPIC_KEYWORDS = {
+    "contact_phone": {
+        "電話": 3,
+        "フリーダイヤル": 3,
+        "相続センター": 3,
+        "受付時間": 2,
+        "お問い合わせ": 1,
+        "TEL": 2,
+    },
+    "freeze_method": {
+        "凍結": 4,
+        "ご逝去": 3,
+        "お亡くなり": 3,
+        "亡くなられた": 3,
+        "死亡": 2,
+        "ご連絡": 2,
+        "届出": 2,
+    },
+    "balance_cert": {"残高証明": 4, "相続開始日": 2},
+    "transaction_history": {
+        "取引明細": 4,
+        "取引推移": 4,
+        "取引履歴": 4,
+        "入出金明細": 3,
+    },
+    "cancellation": {
+        "解約": 3,
+        "払戻": 3,
+        "払い戻し": 3,
+        "名義変更": 3,
+        "必要書類": 2,
+        "遺産分割協議書": 2,
+        "戸籍": 2,
+        "印鑑証明": 2,
+    },
+    "investment": {"投資信託": 4, "国債": 4, "投信": 3, "証券": 2, "移管": 2},
+    "safe_deposit": {"貸金庫": 4, "開扉": 3},
+}
+GENERAL_KEYWORDS = {"相続": 2, "手続": 1, "遺言": 1}
+BOILERPLATE_MARKERS = [
+    "Copyright",
+    "©",
+    "All Rights Reserved",
+    "サイトマップ",
+    "プライバシーポリシー",
+    "個人情報保護",
+    "ログイン",
+    "ページの先頭",
+    "ページトップ",
+    "文字サイズ",
+    "印刷する",
+    "Cookie",
+]
+PHONE_PATTERN = re.compile(r"0\d{1,4}[-‐－(（]\d{1,4}[-‐－)）]\d{3,4}")
+
+
+def estimate_tokens(text):
+    # 日本語は1文字≒1トークン、英数字は4文字≒1トークンで見積もる
+    ascii_count = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_count) + ascii_count // 4
+
+
+def split_text_blocks(text):
+    # 改行のないページでも1ブロックが BLOCK_MAX_CHARS を超えないよう、長い行は切る
+    lines = [
+        line[i : i + BLOCK_MAX_CHARS]
+        for line in (line.strip() for line in text.splitlines())
+        for i in range(0, len(line), BLOCK_MAX_CHARS)
+    ]
+    counts = {}
+    for line in lines:
+        counts[line] = counts.get(line, 0) + 1
+
+    blocks = []
+    current = []
+    current_len = 0
+    for line in lines:
+        # 何度も出てくる行 (グローバルナビ等) とフッター定型文は捨てる
+        if counts[line] >= 3 and len(line) < 40:
+            continue
+        if len(line) < 60 and any(m in line for m in BOILERPLATE_MARKERS):
+            continue
+        if current and current_len + len(line) > BLOCK_MAX_CHARS:
+            blocks.append("\n".join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def score_block(block):
+    topic_scores = {}
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        score = sum(w * min(block.count(k), 3) for k, w in keywords.items())
+        if topic == "contact_phone":
+            score += 3 * min(len(PHONE_PATTERN.findall(block)), 3)
+        if score:
+            topic_scores[topic] = score
+    general = sum(w * min(block.count(k), 3) for k, w in GENERAL_KEYWORDS.items())
+    return sum(topic_scores.values()) + general, topic_scores
+
+
+def reduce_text_for_extraction(text, token_budget=EXTRACT_TOKEN_BUDGET):
+    blocks = split_text_blocks(text)
+    joined = "\n".join(blocks)
+    if estimate_tokens(joined) <= token_budget:
+        return joined
+
+    scored = [score_block(b) for b in blocks]
+    # 各項目のベストブロックを先に確保し、残りをスコア順で予算まで詰める
+    order = []
+    for topic in TOPIC_KEYWORDS:
+        best = max(
+            range(len(blocks)),
+            key=lambda i: (scored[i][1].get(topic, 0), -i),
+        )
+        if scored[best][1].get(topic):
+            order.append(best)
+    order += sorted(
+        (i for i in range(len(blocks)) if scored[i][0] > 0),
+        key=lambda i: (-scored[i][0], i),
+    )
+    order = list(dict.fromkeys(order))
+
+    # 連結時の改行と英数字の端数ぶん、1ブロックにつき1トークン余分に見積もる
+    costs = [estimate_tokens(b) + 1 for b in blocks]
+    chosen = []
+    used = 0
+    for i in order:
+        cost = costs[i]
+        if used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+    # 何も当たらないページは先頭から予算分だけ送る
+    if not chosen:
+        for i, cost in enumerate(costs):
+            if used + cost > token_budget:
+                break
+            chosen.append(i)
+            used += cost
+    # それでも入らなければ、先頭ブロックを予算分で切って送る (空では送らない)
+    if not chosen and blocks:
+        return blocks[0][:token_budget]
+    return "\n".join(blocks[i] for i in sorted(chosen))
+
+
+# 抽出する8項目 (キー: 説明)。説明はプロンプトに出し、そのまま返ってきたら無効扱い
+EXTRACT_FIELDS = {
+    "contact_phone": "相続手続きの問い合わせ電話番号",
+    "freeze_method": "口座凍結の連絡方法",
+    "balance_cert": "残高証明書の申請方法",
+    "transaction_history": "取引明細(取引推移)の申請方法",
+    "cancellation": "預金の解約・払戻し手続",
+    "investment": "投資信託・国債の相続手続",
+    "safe_deposit": "貸金庫の相続手続",
+    "summary": "その他の要約",
+}
+EXTRACT_MISSING = "記載なし"
+
+
+def extraction_config(fields):
+    # JSONモード + スキーマ指定で、項目名と型をモデル側に守らせる
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "OBJECT",
+            "properties": {f: {"type": "STRING"} for f in fields},
+            "required": list(fields),
+        },
+    }
+
+
+def validate_extraction(data):
+    # 戻り値: (使える項目だけのdict, 取れなかった項目のリスト)
+    valid = {}
+    if isinstance(data, dict):
+        for field, label in EXTRACT_FIELDS.items():
+            value = data.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            if isinstance(value, str) and value.strip() != label:
+                valid[field] = value.strip() or EXTRACT_MISSING
+    return valid, [f for f in EXTRACT_FIELDS if f not in valid]
+
+
+def extraction_prompt(text, data_type, fields):
+    field_lines = "\n".join(f"- {f}: {EXTRACT_FIELDS[f]}" for f in fields)
+    return f"""
+    行政書士の実務アシスタントとして、{data_type}から相続手続きの情報を抽出してください。
+    次の項目をJSONで出力し、情報がない場合は「{EXTRACT_MISSING}」としてください。
+    {field_lines}
     --- データ ---
-    {text_data[:30000]} 
+    {text}
     """
-    return generate_ultimate_rotation(prompt)
+
+
+def ask_gemini_to_extract_7points(text_data, is_html=True):
+    data_type = "HTML" if is_html else "テキスト"
+    text = reduce_text_for_extraction(text_data)
+    fields = list(EXTRACT_FIELDS)
+    response = generate_ultimate_rotation(
+        extraction_prompt(text, data_type, fields),
+        generation_config=extraction_config(fields),
+    )
+    if response is None:
+        # 使えるキーがない時は、聞き直しても同じだけ待って失敗する
+        return ""
+    data, missing = validate_extraction(extract_json_from_text(response))
+    if missing:
+        # 崩れた項目だけ小さく聞き直す (全滅なら同じ質問をキャッシュを使わずにやり直す)
+        with span("extract.reask", fields=len(missing)):
+            retry = generate_ultimate_rotation(
+                extraction_prompt(text, data_type, missing),
+                use_cache=bool(data),
+                generation_config=extraction_config(missing),
+            )
+        retried, missing = validate_extraction(
+            {**data, **(extract_json_from_text(retry) or {})}
+        )
+        data.update(retried)
+    if not data:
+        return ""
+    return json.dumps(
+        {f: data.get(f, EXTRACT_MISSING) for f in EXTRACT_FIELDS}, ensure_ascii=False
+    )
 
 
 def extract_json_from_text(text):
-    try:
-        match = re.search(r"\{.*\}", text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-    except:
-        pass
+    # 最初に読めたJSONオブジェクトを返す (前後の説明文やコードフェンスは無視)
+    decoder = json.JSONDecoder()
+    start = (text or "").find("{")
+    while start != -1:
+        try:
+            data, _ = decoder.raw_decode(text, start)
+        except ValueError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(data, dict):
+            return data
+        start = text.find("{", start + 1)
     return None
 
 
-def run_selenium_and_extract(target_url):
-    sleep_time = random.uniform(3, 6)
-    time.sleep(sleep_time)
-    options = Options()
+# ============================================================
+# ★ ブラウザプール (Chromeを使い回す)
+# ============================================================
+
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "2"))
+DRIVER_MAX_PAGES = int(os.getenv("DRIVER_MAX_PAGES", "30"))
+DRIVER_ACQUIRE_TIMEOUT = 120
+DRIVER_PAGE_LOAD_TIMEOUT = 45
+
+# lean: DOMContentLoaded で読み込み完了とし、画像・動画・フォント・計測タグは取りに行かない
+# full: 従来どおりすべて読み込む (転送量・時間の比較用)
+BROWSER_MODE = os.getenv("BROWSER_MODE", "lean")
+# ディスクキャッシュはプールの枠ごとに持ち、再起動後も使い回す
+BROWSER_CACHE_DIR = os.path.join(CACHE_DIR, "chrome")
+BROWSER_CACHE_BYTES = 64 * 1024 * 1024
+BROWSER_BLOCKED_URLS = [
+    *(
+        f"*.{ext}*"
+        for ext in [
+            "png",
+            "jpg",
+            "jpeg",
+            "gif",
+            "webp",
+            "avif",
+            "svg",
+            "ico",
+            "woff",
+            "woff2",
+            "ttf",
+            "otf",
+            "eot",
+            "mp4",
+            "webm",
+            "mp3",
+            "m4a",
+        ]
+    ),
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*connect.facebook.net*",
+    "*analytics.twitter.com*",
+    "*clarity.ms*",
+    "*hotjar.com*",
+    "*yjtag.jp*",
+    "*b92.yahoo.co.jp*",
+    "*ad-cloud.jp*",
+    "*ptengine.jp*",
+]
+
+
+@st.cache_resource
+def resolve_chrome_paths():
+    # which() とドライバのダウンロード確認はプロセスで1回だけ行う
+    chromium_path = shutil.which("chromium")
+    chromedriver_path = shutil.which("chromedriver")
+    if chromium_path and chromedriver_path:
+        return chromium_path, chromedriver_path
+    with span("browser.resolve"):
+        manager = load_module("webdriver_manager.chrome").ChromeDriverManager
+        return None, manager().install()
+
+
+def create_chrome_driver(cache_slot=None):
+    webdriver = load_module("selenium.webdriver")
+    lean = BROWSER_MODE == "lean"
+    options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu")
+    if lean:
+        options.page_load_strategy = "eager"
+        for arg in [
+            "--disable-extensions",
+            "--disable-background-networking",
+            "--disable-component-update",
+            "--disable-default-apps",
+            "--disable-sync",
+            "--no-first-run",
+            "--mute-audio",
+            f"--disk-cache-size={BROWSER_CACHE_BYTES}",
+        ]:
+            options.add_argument(arg)
+        if cache_slot is not None:
+            cache_dir = os.path.join(BROWSER_CACHE_DIR, str(cache_slot))
+            os.makedirs(cache_dir, exist_ok=True)
+            options.add_argument(f"--disk-cache-dir={os.path.abspath(cache_dir)}")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_argument(f"--user-agent={random.choice(USER_AGENTS)}")
+    # 転送量はCDPのネットワークイベントで数える (Performance API は他ドメイン分が0になる)
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chromium_path, chromedriver_path = resolve_chrome_paths()
+    if chromium_path:
+        options.binary_location = chromium_path
+    service = webdriver.ChromeService(executable_path=chromedriver_path)
+    driver = webdriver.Chrome(service=service, options=options)
+    # 使い回すので、ページ遷移後も効くように新規ドキュメントごとに注入する
+    driver.execute_cdp_cmd(
+        "Page.addScriptToEvaluateOnNewDocument",
+        {
+            "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+        },
+    )
+    if lean:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BROWSER_BLOCKED_URLS})
+    driver.set_page_load_timeout(DRIVER_PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+def page_transfer_stats(driver):
+    # 前回取り出してからのネットワークイベントを集計する (ブロックした分は blocked に数える)
     try:
-        chromium_path = shutil.which("chromium")
-        chromedriver_path = shutil.which("chromedriver")
-        if chromium_path and chromedriver_path:
-            options.binary_location = chromium_path
-            service = Service(executable_path=chromedriver_path)
-        else:
-            service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        driver.execute_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
-        driver.set_page_load_timeout(45)
+        entries = driver.get_log("performance")
+    except Exception:
+        return {}
+    stats = {"bytes": 0, "requests": 0, "blocked": 0}
+    for entry in entries:
+        message = json.loads(entry["message"])["message"]
+        params = message.get("params", {})
+        if message.get("method") == "Network.loadingFinished":
+            stats["bytes"] += int(params.get("encodedDataLength", 0))
+            stats["requests"] += 1
+        elif message.get("method") == "Network.loadingFailed":
+            stats["blocked"] += 1 if params.get("blockedReason") else 0
+    return stats
+
+
+class ChromeDriverPool:
+    def __init__(self, max_size, max_pages):
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self._idle = []
+        self._pages = {}
+        self._total = 0
+        # ディスクキャッシュの枠番号 (同じキャッシュを2つのChromeで同時に使わない)
+        self._free_slots = list(range(max_size))
+        self._slots = {}
+        self._cond = threading.Condition()
+        self.stats = {"created": 0, "borrowed": 0, "recycled": 0, "crashed": 0}
+
+    def _quit(self, driver):
         try:
-            driver.get(target_url)
-            time.sleep(4)
-            body_text = driver.find_element("tag name", "body").text
-        except:
             driver.quit()
-            return None, "Access Error"
-        driver.quit()
-        json_text = ask_gemini_to_extract_7points(body_text, is_html=True)
-        return json_text, "Success"
+        except Exception:
+            pass
+
+    def _is_healthy(self, driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _drop_slot(self, slot):
+        with self._cond:
+            self._total -= 1
+            self._free_slots.append(slot)
+            self._cond.notify()
+
+    def acquire(self, timeout=DRIVER_ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    driver = self._idle.pop()
+                    slot = self._slots.pop(driver)
+                    break
+                if self._total < self.max_size:
+                    self._total += 1
+                    driver = None
+                    slot = self._free_slots.pop()
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("ブラウザプールに空きがありません")
+                self._cond.wait(remaining)
+
+        if driver is not None and not self._is_healthy(driver):
+            self._quit(driver)
+            with self._cond:
+                self._pages.pop(driver, None)
+                self.stats["crashed"] += 1
+            driver = None
+        if driver is None:
+            try:
+                with span("browser.startup"):
+                    driver = create_chrome_driver(slot)
+            except Exception:
+                self._drop_slot(slot)
+                raise
+            with self._cond:
+                self._pages[driver] = 0
+                self.stats["created"] += 1
+        with self._cond:
+            self._slots[driver] = slot
+            self.stats["borrowed"] += 1
+        return driver
+
+    def release(self, driver):
+        with self._cond:
+            pages = self._pages.get(driver, 0) + 1
+            self._pages[driver] = pages
+        healthy = True
+        if pages < self.max_pages:
+            # 次の利用者に前のページ・Cookieを残さない (落ちていればここで検知)。
+            # delete_all_cookies は今のページのドメインしか消さないので、CDPで全部消す
+            try:
+                driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+                driver.get("about:blank")
+            except Exception:
+                healthy = False
+        if healthy and pages < self.max_pages:
+            with self._cond:
+                self._idle.append(driver)
+                self._cond.notify()
+            return
+        self._quit(driver)
+        with self._cond:
+            self._pages.pop(driver, None)
+            slot = self._slots.pop(driver)
+            self.stats["recycled" if healthy else "crashed"] += 1
+        self._drop_slot(slot)
+
+    @contextmanager
+    def borrow(self):
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            for driver in idle:
+                self._pages.pop(driver, None)
+                self._free_slots.append(self._slots.pop(driver))
+        for driver in idle:
+            self._quit(driver)
+
+    def status(self):
+        with self._cond:
+            return {
+                "size": self._total,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                **self.stats,
+            }
+
+
+@st.cache_resource
+def get_driver_pool():
+    pool = ChromeDriverPool(DRIVER_POOL_SIZE, DRIVER_MAX_PAGES)
+    atexit.register(pool.close_all)
+    return pool
+
+
+# 同一ドメインへのアクセス間隔 (秒)。ドメインが違えば待たない
+DOMAIN_MIN_INTERVAL = float(os.getenv("DOMAIN_MIN_INTERVAL", "3"))
+DOMAIN_JITTER = 2.0
+
+
+class DomainThrottle:
+    def __init__(self, min_interval, jitter):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = (
+                slot + self.min_interval + random.uniform(0, self.jitter)
+            )
+        if slot > now:
+            time.sleep(slot - now)
+
+
+@st.cache_resource
+def get_domain_throttle():
+    return DomainThrottle(DOMAIN_MIN_INTERVAL, DOMAIN_JITTER)
+
+
+# JSで描画されるページは本文がほぼ空になる
+BROWSER_TEXT_TIMEOUT = 10
+
+
+def is_document_ready(driver):
+    return driver.execute_script("return document.readyState") in (
+        "interactive",
+        "complete",
+    )
+
+
+def wait_for_page_text(driver, timeout=BROWSER_TEXT_TIMEOUT):
+    # 固定sleepの代わりに、DOM完成 → 本文の長さが落ち着くまで待つ
+    wait = load_module("selenium.webdriver.support.ui").WebDriverWait
+    wait(driver, timeout).until(is_document_ready)
+    deadline = time.monotonic() + timeout
+    last_length = -1
+    stable_count = 0
+    while time.monotonic() < deadline:
+        length = driver.execute_script(
+            "return document.body ? document.body.innerText.length : 0"
+        )
+        if length and length == last_length:
+            stable_count += 1
+            if stable_count >= 2:
+                break
+        else:
+            stable_count = 0
+            last_length = length
+        time.sleep(0.5)
+    return driver.find_element("tag name", "body").text
+
+
+def run_selenium_and_extract(target_url):
+    with span("browser.throttle"):
+        get_domain_throttle().wait(target_url)
+    try:
+        with get_driver_pool().borrow() as driver:
+            try:
+                # 前の利用者・about:blank の分を捨ててから測る
+                page_transfer_stats(driver)
+                started = time.monotonic()
+                with span("browser.load", url=target_url, mode=BROWSER_MODE):
+                    driver.get(target_url)
+                with span("browser.text_wait"):
+                    body_text = wait_for_page_text(driver)
+                # 読み込み〜本文確定までの時間と転送量 (モードごとの比較用)
+                get_metrics().observe(
+                    "browser.page",
+                    time.monotonic() - started,
+                    url=target_url,
+                    mode=BROWSER_MODE,
+                    **page_transfer_stats(driver),
+                )
+            except Exception:
+                return None, "Access Error"
+        return body_text, "Success"
     except Exception as e:
         return None, f"Error: {str(e)}"
 
 
+# ============================================================
+# ★ 軽量HTTP取得 (静的ページはChromeを使わない)
+# ============================================================
+
+FETCH_TIER_HTTP = "http"
+FETCH_TIER_BROWSER = "browser"
+HTTP_TIMEOUT = 15
+MIN_STATIC_TEXT_LENGTH = 300
+SCRIPT_RENDERED_MARKERS = [
+    "JavaScriptを有効",
+    "JavaScriptが無効",
+    "JavaScriptをオン",
+    "enable JavaScript",
+    "JavaScript is disabled",
+]
+
+
+@st.cache_resource
+def get_http_session():
+    # keep-alive / gzip はSessionに任せ、接続はホストごとにプールする
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(
+        {"User-Agent": USER_AGENTS[0], "Accept-Language": "ja,en;q=0.8"}
+    )
+    return session
+
+
+class BodyTextParser(HTMLParser):
+    SKIP_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+    BLOCK_TAGS = set(
+        "p div br li ul ol tr td th table section article header footer nav "
+        "dt dd h1 h2 h3 h4 h5 h6".split()
+    )
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    parser = BodyTextParser()
+    parser.feed(html)
+    parser.close()
+    lines = [" ".join(line.split()) for line in "".join(parser.parts).splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def looks_script_rendered(text):
+    if len(text) < MIN_STATIC_TEXT_LENGTH:
+        return True
+    return any(marker in text for marker in SCRIPT_RENDERED_MARKERS)
+
+
+def decode_html(resp):
+    # charset指定なしだとrequestsはISO-8859-1扱いになり日本語が化ける
+    if "charset" not in resp.headers.get("Content-Type", "").lower():
+        meta = re.search(
+            rb"<meta[^>]+charset=[\"']?([\w-]+)", resp.content[:4096], re.I
+        )
+        resp.encoding = meta.group(1).decode() if meta else resp.apparent_encoding
+    return resp.text
+
+
+@dataclass
+class HttpPage:
+    text: str = None
+    etag: str = ""
+    last_modified: str = ""
+    not_modified: bool = False
+
+
+def fetch_text_with_http(target_url, etag="", last_modified=""):
+    with span("http.throttle"):
+        get_domain_throttle().wait(target_url)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        with span("http.fetch", url=target_url) as fields:
+            resp = get_http_session().get(
+                target_url, headers=headers, timeout=HTTP_TIMEOUT
+            )
+            fields["status"] = resp.status_code
+        if resp.status_code == 304:
+            return HttpPage(etag=etag, last_modified=last_modified, not_modified=True)
+        resp.raise_for_status()
+    except requests.RequestException:
+        return HttpPage()
+    page = HttpPage(
+        etag=resp.headers.get("ETag", ""),
+        last_modified=resp.headers.get("Last-Modified", ""),
+    )
+    if "html" not in resp.headers.get("Content-Type", "text/html"):
+        return page
+    try:
+        text = html_to_text(decode_html(resp))
+    except (LookupError, ValueError):
+        return page
+    if not looks_script_rendered(text):
+        page.text = text
+    return page
+
+
+def content_fingerprint(text):
+    # 空白・全角半角の揺れでは変化扱いにしない
+    normalized = "".join(unicodedata.normalize("NFKC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+
+def scrape_and_extract(target_url, prev=None):
+    # 戻り値: (LLMのJSON文字列, ステータス, マスタに残す取得メタ情報)
+    # 前回と本文が同じなら LLM を呼ばずに "Unchanged" を返す
+    prev = prev or {}
+    prev_hash = prev.get("コンテンツハッシュ", "")
+    meta = {"取得方式": FETCH_TIER_HTTP, "コンテンツハッシュ": prev_hash}
+    text = None
+    # 前回Chromeが必要だった銀行はHTTPを飛ばす
+    if prev.get("取得方式") != FETCH_TIER_BROWSER:
+        page = fetch_text_with_http(
+            target_url,
+            etag=prev.get("ETag", "") if prev_hash else "",
+            last_modified=prev.get("Last-Modified", "") if prev_hash else "",
+        )
+        meta["ETag"] = page.etag
+        meta["Last-Modified"] = page.last_modified
+        if page.not_modified:
+            return None, "Unchanged", meta
+        text = page.text
+    if not text:
+        meta = {"取得方式": FETCH_TIER_BROWSER, "ETag": "", "Last-Modified": ""}
+        text, status = run_selenium_and_extract(target_url)
+        if not text:
+            return None, status, meta
+    meta["コンテンツハッシュ"] = content_fingerprint(text)
+    if prev_hash and prev_hash == meta["コンテンツハッシュ"]:
+        return None, "Unchanged", meta
+    json_text = ask_gemini_to_extract_7points(text, is_html=True)
+    return json_text, "Success", meta
+
+
+# 検索スニペットからの推測で埋めた行の印 (一括更新でページから取り直せば上書きされる)
+FALLBACK_UPDATED_MARK = "自動取得(Fallback)"
+
+
 # ★チャット用
 def fetch_bank_data_dynamic(bank_name):
     found_url, snippet = search_new_url_with_snippet(bank_name)
     if not found_url:
         return None, "検索失敗"
-    res_json, status = run_selenium_and_extract(found_url)
+    res_json, status, meta = scrape_and_extract(found_url)
     data = extract_json_from_text(res_json)
     if status == "Success" and data:
         return {
@@ -260,6 +2185,7 @@ def fetch_bank_data_dynamic(bank_name):
             "貸金庫": data.get("safe_deposit", ""),
             "AI要約": data.get("summary", ""),
             "最終更新": "自動取得(Live)",
+            **meta,
         }, "Success"
     elif snippet:
         res_fb = ask_gemini_to_extract_7points(snippet, is_html=False)
@@ -276,20 +2202,22 @@ def fetch_bank_data_dynamic(bank_name):
                 "投信国債": data_fb.get("investment", ""),
                 "貸金庫": data_fb.get("safe_deposit", ""),
                 "AI要約": data_fb.get("summary", "") + "(検索推測)",
-                "最終更新": "自動取得(Fallback)",
+                "最終更新": FALLBACK_UPDATED_MARK,
             }, "Fallback"
     return None, "失敗"
 
 
 # ★管理画面用（URL優先更新）
-def update_bank_data_smart(bank_name, existing_url):
+def update_bank_data_smart(bank_name, existing_url, prev=None, log=st.write):
     target_url = existing_url
     if not target_url or pd.isna(target_url) or target_url == "":
         if bank_name in BANK_MASTER_DB:
             target_url = BANK_MASTER_DB[bank_name]
     if target_url:
-        st.write(f"   → サイト解析: {target_url}")
-        res_json, status = run_selenium_and_extract(target_url)
+        log(f"   → サイト解析: {target_url}")
+        res_json, status, meta = scrape_and_extract(target_url, prev)
+        if status == "Unchanged":
+            return {"金融機関名": bank_name, "WebサイトURL": target_url, **meta}, status
         data = extract_json_from_text(res_json)
         if status == "Success" and data:
             return {
@@ -304,28 +2232,960 @@ def update_bank_data_smart(bank_name, existing_url):
                 "貸金庫": data.get("safe_deposit", ""),
                 "AI要約": data.get("summary", ""),
                 "最終更新": "一括更新",
+                **meta,
             }, "Success"
-    st.write("   → URL不明/失敗のため検索中...")
+    log("   → URL不明/失敗のため検索中...")
     return fetch_bank_data_dynamic(bank_name)
 
 
-def fetch_specific_detail(bank_name, topic):
+# ============================================================
+# ★ Web調査の共有 (同じ銀行の同時調査を1回にまとめ、結果はマスタへ)
+# ============================================================
+
+LIVE_LOOKUP_WORKERS = int(os.getenv("LIVE_LOOKUP_WORKERS", "2"))
+
+
+class SingleFlight:
+    # 同じキーの処理が実行中なら、新しく始めずにその結果を待つ
+    def __init__(self, workers, name):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+        self.started = 0
+        self.coalesced = 0
+
+    def run(self, key, fn, *args):
+        # 処理は専用スレッドで動かすので、呼び出し元の画面が再実行されても止まらない
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._executor.submit(fn, *args)
+                self._calls[key] = future
+                self.started += 1
+            else:
+                self.coalesced += 1
+        if owner:
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return future.result()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+@st.cache_resource
+def get_live_lookup_flights():
+    return SingleFlight(LIVE_LOOKUP_WORKERS, "live-lookup")
+
+
+def merge_master_frame(df, incoming):
+    # 金融機関名の表記ゆれで突き合わせ、既存行は値のある列 (NaN以外) だけ上書きする。
+    # 登録済みの名前と行の並びは残し、新しい銀行は末尾に足す (シートへは差分だけ送られる)
+    df = df.copy()
+    for c in COLS:
+        if c not in df.columns:
+            df[c] = ""
+    incoming = incoming[[c for c in COLS if c in incoming.columns]].copy()
+    incoming.index = normalize_bank_series(incoming["金融機関名"])
+    incoming = incoming[incoming.index != ""]
+    incoming = incoming[~incoming.index.duplicated(keep="last")]
+    keys = normalize_bank_series(df["金融機関名"])
+    found = keys.isin(incoming.index)
+    changed = 0
+    if found.any():
+        updates = incoming.drop(columns="金融機関名").loc[keys[found]]
+        updates.index = df.index[found]
+        before = df.loc[found, updates.columns].copy()
+        df.update(updates)
+        changed = int((df.loc[found, updates.columns] != before).any(axis=1).sum())
+    added = incoming[~incoming.index.isin(keys)]
+    if len(added):
+        df = pd.concat([df, added.reset_index(drop=True)], ignore_index=True)
+    return df.fillna(""), len(added), changed
+
+
+def upsert_master_rows(df, rows):
+    return merge_master_frame(df, pd.DataFrame(rows))[0]
+
+
+def fetch_and_store_bank(bank_name):
+    # 先に誰かが調べてマスタに残っていれば、同時でなくても調べ直さない
+    store = get_master_store()
+    stored = store.row(bank_name) if store else None
+    if stored is not None:
+        if stored.get("最終更新") == FALLBACK_UPDATED_MARK:
+            return stored, "Fallback"
+        return stored, "Success"
+    with get_metrics().bank(bank_name) as outcome:
+        data, status = fetch_bank_data_dynamic(bank_name)
+        outcome["status"] = status
+    if status in EXTRACTED_STATUSES and data:
+        # 推測 (Fallback) の行は最終更新の印を残し、ページから取れた行は日時を入れる
+        row = dict(data)
+        if status == "Success":
+            row["最終更新"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        get_master_replica().update_frame(lambda df: upsert_master_rows(df, [row]))
+        push_master_upstream()
+    return data, status
+
+
+def clean_bank_query(text):
+    # 「○○銀行の手続き教えて」→「○○銀行」(入力文をそのまま銀行名として保存しない)
+    text = QUERY_NOISE_PATTERN.sub("", unicodedata.normalize("NFKC", str(text)))
+    return text.strip().rstrip("?!。、").strip()
+
+
+def lookup_bank_live(bank_name):
+    bank_name = clean_bank_query(bank_name)
+    if not bank_name:
+        return None, "失敗"
+    return get_live_lookup_flights().run(
+        normalize_bank_text(bank_name), fetch_and_store_bank, bank_name
+    )
+
+
+# ============================================================
+# ★ Excelからの一括取り込み (読み取り専用モードで少しずつ読む)
+# ============================================================
+
+BANK_MASTER_XLSX = "bank_master.xlsx"
+IMPORT_CHUNK_ROWS = 2000
+# 取り込み時は「値なし」とみなす (未取得の印・取得失敗時の文言で既存の値を消さない)
+IMPORT_MISSING_VALUES = ["未取得", "-", "このサイトにアクセスできません"]
+IMPORT_ERROR_PREFIXES = ("エラー:", "Error:", "Access Error")
+
+
+def iter_workbook_frames(file, chunk_rows=IMPORT_CHUNK_ROWS):
+    # 先頭シートの1行目を見出しとして、COLS にある列だけを chunk_rows 行ずつ返す
+    openpyxl = load_module("openpyxl")
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        header = ["" if v is None else str(v).strip() for v in header]
+        if "金融機関名" not in header:
+            raise ValueError("1行目に「金融機関名」の列がありません")
+        columns = {i: name for i, name in enumerate(header) if name in COLS}
+        rows = sheet.iter_rows(min_row=2, max_col=len(header), values_only=True)
+        while True:
+            chunk = [row for _, row in zip(range(chunk_rows), rows)]
+            if not chunk:
+                break
+            frame = pd.DataFrame.from_records(chunk, columns=range(len(header)))
+            yield normalize_import_frame(frame[list(columns)].rename(columns=columns))
+    finally:
+        workbook.close()
+
+
+def normalize_import_frame(frame):
+    if "最終更新" in frame and pd.api.types.is_datetime64_any_dtype(frame["最終更新"]):
+        frame["最終更新"] = frame["最終更新"].dt.strftime("%Y-%m-%d %H:%M")
+    frame = frame.astype(object).where(frame.notna(), "").astype(str)
+    frame = frame.apply(lambda col: col.str.strip())
+    frame["金融機関名"] = frame["金融機関名"].str.normalize("NFKC")
+    # 「不明」などは既存の値を消さないよう、値なし (NaN) として扱う
+    missing = frame.isin(MISSING_VALUES + IMPORT_MISSING_VALUES)
+    missing |= frame.apply(lambda col: col.str.startswith(IMPORT_ERROR_PREFIXES))
+    frame = frame.mask(missing)
+    return frame[frame["金融機関名"].notna()]
+
+
+def import_master_workbook(file):
+    result = {"rows": 0, "added": 0, "changed": 0}
+
+    def merge(df):
+        for frame in iter_workbook_frames(file):
+            df, added, changed = merge_master_frame(df, frame)
+            result["rows"] += len(frame)
+            result["added"] += added
+            result["changed"] += changed
+        return df
+
+    with span("import.xlsx") as fields:
+        get_master_replica().update_frame(merge)
+        fields.update(result)
+    push_master_upstream()
+    return result
+
+
+# ============================================================
+# ★ 一括更新エンジン (並列)
+# ============================================================
+
+# ブラウザはプール上限、LLMはキー数で頭打ちになるので、それ以上は増やしても速くならない
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))
+
+
+def refresh_banks_concurrently(targets, workers=BULK_WORKERS, cancel_event=None):
+    # targets: [(行index, 行dict)]。終わった順に (行index, 銀行名, 結果, ステータス) を返す
+    def work(row):
+        if cancel_event is not None and cancel_event.is_set():
+            return None, "Cancelled"
+        with get_metrics().bank(row["金融機関名"]) as outcome:
+            res_data, stat = update_bank_data_smart(
+                row["金融機関名"], row["WebサイトURL"], prev=row, log=lambda *_: None
+            )
+            outcome["status"] = stat
+        return res_data, stat
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {
+            executor.submit(work, row): (i, row["金融機関名"]) for i, row in targets
+        }
+        for future in as_completed(futures):
+            i, bank = futures[future]
+            try:
+                res_data, stat = future.result()
+            except Exception as e:
+                res_data, stat = None, f"Error: {str(e)}"
+            yield i, bank, res_data, stat
+    finally:
+        # 途中で打ち切られたら、まだ始まっていない銀行は実行せず、実行中の銀行は待つ
+        # (後ろで動き続けると、すぐ再開したジョブと同じ銀行を二重に調べてしまう)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# ============================================================
+# ★ 一括更新ジョブ (バックグラウンド実行・途中再開)
+# ============================================================
+
+# 例: "03:00" で毎日3時に実行。空なら手動のみ
+BULK_REFRESH_SCHEDULE = os.getenv("BULK_REFRESH_SCHEDULE", "")
+JOB_SAVE_EVERY = 3
+VALIDATOR_COLS = ["ETag", "Last-Modified"]
+
+
+def parse_schedule(value):
+    # "HH:MM" → (時, 分)。形式が違えば ValueError
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", value.strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(
+            f"BULK_REFRESH_SCHEDULE は HH:MM 形式で指定してください: {value!r}"
+        )
+    return int(match.group(1)), int(match.group(2))
+
+
+EXTRACTED_STATUSES = ["Success", "Fallback"]
+
+
+def apply_refresh_results(df, items):
+    # items: [(銀行名, ステータス, 結果dict, 完了時刻)]。同じ結果を何度当てても同じ状態になる
+    df = df.copy()
+    for c in COLS:
+        if c not in df.columns:
+            df[c] = ""
+    rows_by_bank = defaultdict(list)
+    for i, bank in zip(df.index, df["金融機関名"]):
+        rows_by_bank[bank].append(i)
+    for bank, stat, res_data, finished_at in items:
+        if stat == "Unchanged":
+            # 本文は同じでも検証子が新しくなっていれば残す (次回の 304 判定に使う)
+            for i in rows_by_bank.get(bank, []):
+                for k in VALIDATOR_COLS:
+                    if res_data and k in res_data:
+                        df.at[i, k] = res_data[k]
+            continue
+        for i in rows_by_bank.get(bank, []):
+            if stat in EXTRACTED_STATUSES and res_data:
+                for k in COLS:
+                    if k in res_data:
+                        df.at[i, k] = res_data[k]
+            df.at[i, "最終更新"] = datetime.datetime.fromtimestamp(
+                finished_at
+            ).strftime("%Y-%m-%d %H:%M")
+    return df
+
+
+class BulkRefreshJobs:
+    def __init__(self, path, replica, push_upstream):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.replica = replica
+        self.push_upstream = push_upstream
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._threads = {}
+        self._cancel_events = {}
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT,
+                trigger TEXT,
+                total INTEGER,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS job_items (
+                job_id TEXT,
+                bank TEXT,
+                status TEXT,
+                result TEXT,
+                finished_at REAL,
+                PRIMARY KEY (job_id, bank)
+            )""")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # 前回プロセスが落ちた時点で実行中だったジョブは続きから再開する
+        interrupted = self._query(
+            "SELECT id FROM jobs WHERE status = 'running' ORDER BY created_at DESC"
+        )
+        self._query("UPDATE jobs SET status = 'interrupted' WHERE status = 'running'")
+        if interrupted:
+            self.start(trigger="resume", resume_id=interrupted[0][0])
+        self.schedule_error = ""
+        if BULK_REFRESH_SCHEDULE:
+            try:
+                schedule = parse_schedule(BULK_REFRESH_SCHEDULE)
+            except ValueError as e:
+                self.schedule_error = str(e)
+            else:
+                threading.Thread(
+                    target=self._schedule_loop,
+                    args=schedule,
+                    name="bulk-refresh-schedule",
+                    daemon=True,
+                ).start()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def running_job_id(self):
+        with self._lock:
+            for job_id, thread in self._threads.items():
+                if thread.is_alive():
+                    return job_id
+        return None
+
+    def start(self, trigger="manual", resume_id=None):
+        with self._start_lock:
+            return self._start(trigger, resume_id)
+
+    def _start(self, trigger, resume_id):
+        running = self.running_job_id()
+        if running:
+            return running
+        now = time.time()
+        job_id = resume_id or uuid.uuid4().hex[:8]
+        if resume_id:
+            self._query(
+                "UPDATE jobs SET status = 'running', error = '', updated_at = ? "
+                "WHERE id = ?",
+                (now, job_id),
+            )
+        else:
+            self._query(
+                "INSERT INTO jobs VALUES (?, 'running', ?, 0, '', ?, ?)",
+                (job_id, trigger, now, now),
+            )
+        cancel_event = threading.Event()
+        thread = threading.Thread(
+            target=self._run,
+            args=(job_id, cancel_event),
+            name=f"bulk-refresh-{job_id}",
+            daemon=True,
+        )
+        with self._lock:
+            self._threads[job_id] = thread
+            self._cancel_events[job_id] = cancel_event
+        thread.start()
+        return job_id
+
+    def cancel(self, job_id):
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event:
+            event.set()
+
+    def _items(self, job_id):
+        return [
+            (bank, stat, json.loads(result) if result else None, finished_at)
+            for bank, stat, result, finished_at in self._query(
+                "SELECT bank, status, result, finished_at FROM job_items "
+                "WHERE job_id = ? ORDER BY finished_at",
+                (job_id,),
+            )
+        ]
+
+    def _save(self, job_id):
+        items = self._items(job_id)
+        self.replica.update_frame(lambda df: apply_refresh_results(df, items))
+        self.push_upstream()
+
+    def _run(self, job_id, cancel_event):
+        status, error = "completed", ""
+        try:
+            df = self.replica.load_frame()
+            if df.empty or "金融機関名" not in df.columns:
+                raise ValueError("マスタが空です")
+            for c in COLS:
+                if c not in df.columns:
+                    df[c] = ""
+            done = {bank for bank, *_ in self._items(job_id)}
+            targets = [
+                (i, row.to_dict())
+                for i, row in df.iterrows()
+                if row["金融機関名"] and row["金融機関名"] not in done
+            ]
+            self._query(
+                "UPDATE jobs SET total = ? WHERE id = ?",
+                (len(done) + len(targets), job_id),
+            )
+            prev_rows = {row["金融機関名"]: row for _, row in targets}
+            unsaved = 0
+            # 中止されても、実行中だった銀行の結果は受け取って残す (未着手の銀行は
+            # Cancelled で返ってくる)
+            for _, bank, res_data, stat in refresh_banks_concurrently(
+                targets, cancel_event=cancel_event
+            ):
+                if stat == "Cancelled":
+                    continue
+                self._query(
+                    "INSERT OR REPLACE INTO job_items VALUES (?, ?, ?, ?, ?)",
+                    (
+                        job_id,
+                        bank,
+                        stat,
+                        json.dumps(res_data, ensure_ascii=False) if res_data else "",
+                        time.time(),
+                    ),
+                )
+                self._query(
+                    "UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id)
+                )
+                # 本文も検証子も前回と同じ銀行は行もシートも触らない
+                prev = prev_rows.get(bank, {})
+                if stat != "Unchanged" or any(
+                    (res_data or {}).get(k, prev.get(k)) != prev.get(k)
+                    for k in VALIDATOR_COLS
+                ):
+                    unsaved += 1
+                if unsaved >= JOB_SAVE_EVERY:
+                    self._save(job_id)
+                    unsaved = 0
+            if unsaved:
+                self._save(job_id)
+            if cancel_event.is_set():
+                status = "cancelled"
+        except Exception as e:
+            status, error = "failed", str(e)
+        finally:
+            self._query(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+            with self._lock:
+                self._threads.pop(job_id, None)
+                self._cancel_events.pop(job_id, None)
+
+    def latest_job(self):
+        rows = self._query(
+            "SELECT id, status, trigger, total, error, created_at, updated_at "
+            "FROM jobs ORDER BY created_at DESC LIMIT 1"
+        )
+        if not rows:
+            return None
+        job = dict(
+            zip(
+                [
+                    "id",
+                    "status",
+                    "trigger",
+                    "total",
+                    "error",
+                    "created_at",
+                    "updated_at",
+                ],
+                rows[0],
+            )
+        )
+        counts = {"extracted": 0, "skipped": 0, "failed": 0}
+        last_bank = ""
+        for bank, stat in self._query(
+            "SELECT bank, status FROM job_items WHERE job_id = ? ORDER BY finished_at",
+            (job["id"],),
+        ):
+            if stat == "Unchanged":
+                counts["skipped"] += 1
+            elif stat in EXTRACTED_STATUSES:
+                counts["extracted"] += 1
+            else:
+                counts["failed"] += 1
+            last_bank = f"{bank} ({stat})"
+        job.update(counts)
+        job["done"] = sum(counts.values())
+        job["last_bank"] = last_bank
+        return job
+
+    def _schedule_loop(self, hour, minute):
+        while True:
+            time.sleep(30)
+            try:
+                self._run_if_due(hour, minute)
+            except Exception as e:
+                # 1回の失敗でスレッドごと止めない (管理画面に表示する)
+                self.schedule_error = str(e)
+
+    def _run_if_due(self, hour, minute):
+        now = datetime.datetime.now()
+        due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        today = due.date().isoformat()
+        last = self._query("SELECT value FROM job_meta WHERE key = 'last_scheduled'")
+        if now < due or (last and last[0][0] == today):
+            return
+        self._query(
+            "INSERT OR REPLACE INTO job_meta VALUES ('last_scheduled', ?)", (today,)
+        )
+        self.start(trigger="schedule")
+        self.schedule_error = ""
+
+
+def push_master_upstream():
+    if not os.path.exists(SERVICE_ACCOUNT_FILE):
+        return
+    replica = get_master_replica()
     try:
-        query = f"{bank_name} 相続 {topic}"
-        results = DDGS().text(query, max_results=3)
-        if not results:
-            return "情報が見つかりませんでした。"
-        snippet_text = "\n".join([f"- {r.get('body', '')}" for r in results])
-        prompt = f"""
-        行政書士のアシスタントとして、以下の検索結果から
-        「{bank_name}」の「{topic}」に関する手続き方法を簡潔にまとめてください。
-        箇条書きで、実務に必要な情報だけを抽出してください。
-        --- 検索結果 ---
-        {snippet_text}
-        """
-        return generate_ultimate_rotation(prompt)
+        sync_master_replica(replica, get_sheet_connection())
     except Exception as e:
-        return f"調査中にエラーが発生しました: {str(e)}"
+        # シートに送れなくても複製には残っている (同期スレッドが再送する)
+        replica.last_error = str(e)
+
+
+@st.cache_resource
+def get_bulk_refresh_jobs():
+    return BulkRefreshJobs(
+        os.path.join(CACHE_DIR, "jobs.sqlite3"),
+        get_master_replica(),
+        push_master_upstream,
+    )
+
+
+LLM_DETAIL_TTL = 24 * 3600
+
+
+def detail_search_query(bank_name, topic):
+    return f"{bank_name} 相続 {topic}"
+
+
+def stream_specific_detail(
+    bank_name, topic, refresh=False, key_timeout=KEY_WAIT_TIMEOUT, cancel_event=None
+):
+    # 2回目以降は検索もLLMも飛ばしてキャッシュから返す
+    cache_key = f"detail\n{bank_name}\n{topic}"
+    if not refresh:
+        cached = get_llm_cache().get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    try:
+        results = get_web_search().search(
+            detail_search_query(bank_name, topic), refresh=refresh
+        )
+    except Exception as e:
+        yield f"調査中にエラーが発生しました: {str(e)}"
+        return
+    if not results:
+        yield "情報が見つかりませんでした。"
+        return
+    if cancel_event is not None and cancel_event.is_set():
+        return
+    snippet_text = "\n".join([f"- {r.get('body', '')}" for r in results])
+    prompt = f"""
+    行政書士のアシスタントとして、以下の検索結果から
+    「{bank_name}」の「{topic}」に関する手続き方法を簡潔にまとめてください。
+    箇条書きで、実務に必要な情報だけを抽出してください。
+    --- 検索結果 ---
+    {snippet_text}
+    """
+    yield from stream_ultimate_rotation(
+        prompt,
+        use_cache=False,
+        cache_key=cache_key,
+        ttl=LLM_DETAIL_TTL,
+        key_timeout=key_timeout,
+    )
+
+
+def fetch_specific_detail(
+    bank_name, topic, refresh=False, key_timeout=KEY_WAIT_TIMEOUT, cancel_event=None
+):
+    return collect_stream(
+        stream_specific_detail(bank_name, topic, refresh, key_timeout, cancel_event)
+    )
+
+
+# ============================================================
+# ★ 未登録項目の先読み (銀行選択時にバックグラウンドで調査)
+# ============================================================
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+# 先読みは空いているキーがある時だけ使い、ボタン操作の分を食いつぶさない
+PREFETCH_KEY_TIMEOUT = 0
+MISSING_VALUES = ["", "記載なし", "不明"]
+
+
+def is_missing_value(value):
+    return not value or value in MISSING_VALUES
+
+
+@st.cache_resource
+def get_prefetch_executor():
+    return ThreadPoolExecutor(
+        max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch"
+    )
+
+
+class DetailPrefetch:
+    # セッションごとに1つ。別の銀行を選んだら cancel() で捨てる
+    def __init__(self, bank_name, topics):
+        self.bank_name = bank_name
+        self.cancel_event = threading.Event()
+        executor = get_prefetch_executor()
+        self.futures = {topic: executor.submit(self._run, topic) for topic in topics}
+
+    def _run(self, topic):
+        if self.cancel_event.is_set():
+            return None
+        return fetch_specific_detail(
+            self.bank_name,
+            topic,
+            key_timeout=PREFETCH_KEY_TIMEOUT,
+            cancel_event=self.cancel_event,
+        )
+
+    def is_running(self, bank_name, topic):
+        future = self.futures.get(topic) if bank_name == self.bank_name else None
+        return future is not None and not future.done()
+
+    def cancel(self):
+        self.cancel_event.set()
+        for future in self.futures.values():
+            future.cancel()
+
+
+# ============================================================
+# ★ 銀行名検索インデックス (表記ゆれ対応)
+# ============================================================
+
+LETTER_READINGS = {
+    "a": "えー",
+    "b": "びー",
+    "c": "しー",
+    "d": "でぃー",
+    "e": "いー",
+    "f": "えふ",
+    "g": "じー",
+    "h": "えいち",
+    "i": "あい",
+    "j": "じぇい",
+    "k": "けー",
+    "l": "える",
+    "m": "えむ",
+    "n": "えぬ",
+    "o": "おー",
+    "p": "ぴー",
+    "q": "きゅー",
+    "r": "あーる",
+    "s": "えす",
+    "t": "てぃー",
+    "u": "ゆー",
+    "v": "ぶい",
+    "w": "だぶりゅー",
+    "x": "えっくす",
+    "y": "わい",
+    "z": "ぜっと",
+}
+ROMAJI_TABLE = {
+    **dict(zip("aiueo", "あいうえお")),
+    **{
+        c + v: k
+        for c, row in {
+            "k": "かきくけこ",
+            "s": "さしすせそ",
+            "t": "たちつてと",
+            "n": "なにぬねの",
+            "h": "はひふへほ",
+            "m": "まみむめも",
+            "y": "や\0ゆ\0よ",
+            "r": "らりるれろ",
+            "w": "わ\0\0\0を",
+            "g": "がぎぐげご",
+            "z": "ざじずぜぞ",
+            "d": "だぢづでど",
+            "b": "ばびぶべぼ",
+            "p": "ぱぴぷぺぽ",
+        }.items()
+        for v, k in zip("aiueo", row)
+        if k != "\0"
+    },
+    **{
+        c + v: k + small
+        for c, k in {
+            "ky": "き",
+            "sh": "し",
+            "ch": "ち",
+            "ny": "に",
+            "hy": "ひ",
+            "my": "み",
+            "ry": "り",
+            "gy": "ぎ",
+            "j": "じ",
+            "by": "び",
+            "py": "ぴ",
+        }.items()
+        for v, small in zip("auo", "ゃゅょ")
+    },
+    "shi": "し",
+    "chi": "ち",
+    "tsu": "つ",
+    "fu": "ふ",
+    "ji": "じ",
+    "je": "じぇ",
+}
+QUERY_NOISE_WORDS = ["手続き", "手続", "教えて", "について", "相続"]
+# 手続語の前の助詞 (「の手続き」「を教えて」) もまとめて外す。銀行名の末尾の「の」等は残す
+QUERY_NOISE_PATTERN = re.compile(
+    "[のをはで]?(?:" + "|".join(map(re.escape, QUERY_NOISE_WORDS)) + ")"
+)
+SEARCH_RELATIVE_CUTOFF = 0.6
+SEARCH_MIN_COVERAGE = 0.5
+
+
+# カタカナ → ひらがな
+KANA_FOLD = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def fold_kana(text):
+    return text.translate(KANA_FOLD)
+
+
+def normalize_bank_text(text):
+    text = fold_kana(unicodedata.normalize("NFKC", str(text)).lower())
+    return "".join(c for c in text if c.isalnum() or c == "ー")
+
+
+def normalize_bank_series(names):
+    # normalize_bank_text と同じ結果を列ごとにまとめて出す (\w は isalnum と _ に一致)
+    return (
+        names.fillna("")
+        .astype(str)
+        .str.normalize("NFKC")
+        .str.lower()
+        .str.translate(KANA_FOLD)
+        .str.replace(r"[^\wー]|_", "", regex=True)
+    )
+
+
+def spell_latin_as_kana(text):
+    # 「UFJ」→「ゆーえふじぇい」(社名の英字をカナ読みで入力されたとき用)
+    return "".join(LETTER_READINGS.get(c, c) for c in text)
+
+
+def romaji_to_kana(text):
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if not ("a" <= c <= "z"):
+            out.append(c)
+            i += 1
+            continue
+        nxt = text[i + 1 : i + 2]
+        if c == nxt and c not in "aiueon":
+            out.append("っ")
+            i += 1
+            continue
+        if c == "n" and (not nxt or nxt not in "aiueoy"):
+            out.append("ん")
+            i += 2 if nxt == "n" else 1
+            continue
+        for size in (3, 2, 1):
+            kana = ROMAJI_TABLE.get(text[i : i + size])
+            if kana:
+                out.append(kana)
+                i += size
+                break
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def bank_name_forms(name):
+    base = normalize_bank_text(name)
+    return list(dict.fromkeys([base, spell_latin_as_kana(base)]))
+
+
+def query_forms(query):
+    text = str(query)
+    for word in QUERY_NOISE_WORDS:
+        text = text.replace(word, "")
+    base = normalize_bank_text(text)
+    return list(
+        dict.fromkeys(
+            f for f in [base, spell_latin_as_kana(base), romaji_to_kana(base)] if f
+        )
+    )
+
+
+def text_ngrams(text):
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class BankSearchIndex:
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(str(n) for n in names if n and str(n).strip()))
+        self._forms = [bank_name_forms(n) for n in self.names]
+        self._exact = {}
+        self._postings = defaultdict(set)
+        for idx, forms in enumerate(self._forms):
+            for form in forms:
+                self._exact.setdefault(form, idx)
+                for gram in text_ngrams(form):
+                    self._postings[gram].add(idx)
+        total = max(1, len(self.names))
+        self._idf = {
+            gram: math.log(1 + total / len(ids)) for gram, ids in self._postings.items()
+        }
+        self._unknown_idf = math.log(1 + total)
+
+    def search(self, query, limit=None):
+        forms = query_forms(query)
+        for form in forms:
+            if form in self._exact:
+                return [self.names[self._exact[form]]]
+
+        scores = defaultdict(float)
+        contained = set()
+        for form in forms:
+            grams = text_ngrams(form)
+            weight_total = sum(self._idf.get(g, self._unknown_idf) for g in grams)
+            if not weight_total:
+                continue
+            form_scores = defaultdict(float)
+            for gram in grams:
+                for idx in self._postings.get(gram, ()):
+                    form_scores[idx] += self._idf[gram]
+            for idx, score in form_scores.items():
+                coverage = score / weight_total
+                name_forms = self._forms[idx]
+                if any(form in nf for nf in name_forms):
+                    coverage += 0.5
+                # 「みずほ銀行の手続き」のように銀行名を丸ごと含む入力
+                if any(len(nf) > 1 and nf in form for nf in name_forms):
+                    contained.add(idx)
+                scores[idx] = max(scores[idx], coverage)
+
+        if contained:
+            longest = max(len(self._forms[i][0]) for i in contained)
+            ranked = [i for i in contained if len(self._forms[i][0]) == longest]
+        else:
+            ranked = [i for i, sc in scores.items() if sc >= SEARCH_MIN_COVERAGE]
+            if ranked:
+                best = max(scores[i] for i in ranked)
+                ranked = [
+                    i for i in ranked if scores[i] >= best * SEARCH_RELATIVE_CUTOFF
+                ]
+        ranked.sort(key=lambda i: (-scores[i], len(self.names[i]), i))
+        return [self.names[i] for i in ranked[:limit]]
+
+
+@st.cache_resource(max_entries=2)
+def get_bank_search_index(names):
+    # names はタプル。マスタの銀行名が変わったときだけ作り直す
+    return BankSearchIndex(names)
+
+
+# ============================================================
+# ★ 画面設定
+# ============================================================
+
+BANKS_PER_PAGE = 40
+
+# (ボタン表示, マスタの列名, Web調査時のトピック名)
+TOPIC_BUTTONS = [
+    ("📞 連絡先", "電話番号", "相続センター電話番号"),
+    ("🧊 凍結手続", "凍結方法", "口座凍結の手続き"),
+    ("📄 残高証明", "残高証明", "残高証明書の発行"),
+    ("📊 取引明細", "取引明細", "取引推移証明書の発行"),
+    ("🚪 解約手続", "解約手続", "相続預金の解約手続"),
+    ("📈 投信国債", "投信国債", "投資信託・国債の相続"),
+    ("🔐 貸金庫", "貸金庫", "貸金庫の相続手続"),
+]
+
+
+def startup_caption():
+    report = get_startup_report()
+    if report["first_render"] is None:
+        return None
+    text = f"起動: 初回描画 {report['first_render']}秒"
+    if report["last_rerun"] is not None:
+        text += f" / 直近の再実行 {report['last_rerun']}秒"
+    if report["imports"]:
+        text += " / 読み込み: " + ", ".join(
+            f"{name} {seconds}秒" for name, seconds in report["imports"].items()
+        )
+    return text
+
+
+def metrics_panel():
+    metrics = get_metrics()
+    startup = startup_caption()
+    if startup:
+        st.caption(startup)
+    rates = metrics.outcome_rates()
+    total = sum(n for n, _ in rates.values())
+    if total:
+        grouped = {"成功": 0, "推測(Fallback)": 0, "変更なし": 0, "失敗": 0}
+        for status, (n, _) in rates.items():
+            key = {
+                "Success": "成功",
+                "Fallback": "推測(Fallback)",
+                "Unchanged": "変更なし",
+            }.get(status, "失敗")
+            grouped[key] += n
+        for col, (label, n) in zip(st.columns(len(grouped)), grouped.items()):
+            col.metric(label, f"{n / total:.0%}", f"{n}件", delta_color="off")
+    stage_rows = metrics.stage_table()
+    if not stage_rows:
+        st.caption("まだ計測データがありません。")
+        return
+    st.dataframe(pd.DataFrame(stage_rows), hide_index=True)
+    stage = st.selectbox("ヒストグラム", [r["段階"] for r in stage_rows])
+    st.bar_chart(metrics.histogram(stage), sort=False)
+    bank_rows = metrics.bank_table()
+    if bank_rows:
+        st.markdown("**銀行ごとのコスト** (所要時間の長い順)")
+        st.dataframe(pd.DataFrame(bank_rows), hide_index=True)
+    st.caption(
+        f"詳細ログ: {SPAN_LOG_FILE}"
+        + (f" / Prometheus: :{METRICS_PORT}/metrics" if METRICS_PORT else "")
+    )
+
+
+def write_stream_to(area, chunks):
+    # 届いた分だけ随時表示する。キー切り替えでやり直しになったら表示も消す
+    parts = []
+    for chunk in chunks:
+        if chunk is STREAM_RESET:
+            parts = []
+        elif chunk is not STREAM_FAILED:
+            parts.append(chunk)
+        area.markdown("".join(parts) + " ▌")
+    text = "".join(parts)
+    area.markdown(text)
+    return text
 
 
 # JavaScript Hooks
@@ -357,268 +3217,427 @@ def scroll_to_results():
 # ★ App Main
 # ============================================================
 
-st.set_page_config(page_title="銀行手続システム(Local)", layout="wide")
-page = st.sidebar.radio(
-    "メニュー選択", ["🤖 AIアシスタント (実務用)", "📝 マスタ管理・更新 (管理者用)"]
-)
-
-df, _ = get_google_sheet_data_cached()
-worksheet = get_worksheet_object()
 
-# ------------------------------------------------------------
-# PAGE 1: AIアシスタント (実務用)
-# ------------------------------------------------------------
-if page == "🤖 AIアシスタント (実務用)":
-    st.title("🤖 銀行手続 AIコンシェルジュ (Local)")
-    st.info(
-        "「三菱UFJ」「みずほ銀行」など入力してください。なお、ufjなど部分的な言葉でもOKです。"
+def main():
+    st.set_page_config(page_title="銀行手続システム(Local)", layout="wide")
+    start_metrics_server()
+    # 中断ジョブの再開と定期実行は、どのページを開いても最初の実行で始める
+    get_bulk_refresh_jobs()
+    page = st.sidebar.radio(
+        "メニュー選択", ["🤖 AIアシスタント (実務用)", "📝 マスタ管理・更新 (管理者用)"]
     )
 
-    if "current_bank_data" not in st.session_state:
-        st.session_state.current_bank_data = None
-    if "candidate_list" not in st.session_state:
-        st.session_state.candidate_list = None
-    if "display_result" not in st.session_state:
-        st.session_state.display_result = ""
-    if "display_title" not in st.session_state:
-        st.session_state.display_title = ""
+    store = get_master_store()
+    df = store.frame if store else None
 
-    def select_bank(bank_name_arg):
-        if df is not None:
-            found_row = df[df["金融機関名"] == bank_name_arg]
-            if not found_row.empty:
-                data = found_row.iloc[0].to_dict()
+    # ------------------------------------------------------------
+    # PAGE 1: AIアシスタント (実務用)
+    # ------------------------------------------------------------
+    if page == "🤖 AIアシスタント (実務用)":
+        st.title("🤖 銀行手続 AIコンシェルジュ (Local)")
+        st.info(
+            "「三菱UFJ」「みずほ銀行」など入力してください。なお、ufjなど部分的な言葉でもOKです。"
+        )
+
+        if "current_bank_data" not in st.session_state:
+            st.session_state.current_bank_data = None
+        if "candidate_list" not in st.session_state:
+            st.session_state.candidate_list = None
+        if "display_result" not in st.session_state:
+            st.session_state.display_result = ""
+        if "display_title" not in st.session_state:
+            st.session_state.display_title = ""
+
+        def start_detail_prefetch(data):
+            previous = st.session_state.get("detail_prefetch")
+            if previous and previous.bank_name == data["金融機関名"]:
+                return
+            if previous:
+                previous.cancel()
+            st.session_state.pending_topic = None
+            topics = [
+                t for _, col, t in TOPIC_BUTTONS if is_missing_value(data.get(col, ""))
+            ]
+            st.session_state.detail_prefetch = (
+                DetailPrefetch(data["金融機関名"], topics)
+                if topics and API_KEYS
+                else None
+            )
+
+        def select_bank(bank_name_arg):
+            data = store.row(bank_name_arg) if store else None
+            if data is not None:
                 st.session_state.current_bank_data = data
+                start_detail_prefetch(data)
                 st.session_state.candidate_list = None
+                st.session_state.web_topic = None
+                st.session_state.scroll_pending = True
                 st.session_state.display_title = f"✅ {bank_name_arg} を選択中"
                 st.session_state.display_result = (
                     "下のボタンから詳細を選択してください。"
                 )
                 return
 
-        with st.spinner(f"{bank_name_arg} をWeb調査中..."):
-            data, status = fetch_bank_data_dynamic(bank_name_arg)
-            if status in ["Success", "Fallback"] and data:
-                st.session_state.current_bank_data = data
-                st.session_state.candidate_list = None
-                st.session_state.display_title = f"🎉 {bank_name_arg} (Web調査)"
+            with st.spinner(f"{bank_name_arg} をWeb調査中..."):
+                data, status = lookup_bank_live(bank_name_arg)
+                if status in EXTRACTED_STATUSES and data:
+                    st.session_state.current_bank_data = data
+                    start_detail_prefetch(data)
+                    st.session_state.candidate_list = None
+                    st.session_state.web_topic = None
+                    st.session_state.scroll_pending = True
+                    st.session_state.display_title = f"🎉 {bank_name_arg} (Web調査)"
+                    st.session_state.display_result = (
+                        "下のボタンから詳細を選択してください。"
+                    )
+                else:
+                    st.session_state.display_title = "❌ エラー"
+                    st.session_state.display_result = "情報が見つかりませんでした。"
+
+        def handle_input(user_text):
+            found_candidates = []
+            if store is not None:
+                found_candidates = store.search_index.search(user_text)
+
+            if len(found_candidates) == 1:
+                select_bank(found_candidates[0])
+            elif len(found_candidates) > 1:
+                st.session_state.candidate_list = found_candidates
+                st.session_state.current_bank_data = None
+                st.session_state.display_title = "🤔 複数の候補があります"
+                st.session_state.display_result = "上のリストから選択してください。"
+            else:
+                select_bank(user_text)
+
+        def show_all_topics(data):
+            st.session_state.display_title = "💡 全情報"
+            st.session_state.display_result = f"**📞 連絡先**: {data.get('電話番号', '')}\n**🧊 凍結**: {data.get('凍結方法', '')}\n**📄 残高証明**: {data.get('残高証明', '')}\n**📊 取引明細**: {data.get('取引明細', '')}\n**🚪 解約**: {data.get('解約手続', '')}\n**📈 投信**: {data.get('投信国債', '')}\n**🔐 貸金庫**: {data.get('貸金庫', '')}\n**💡 要約**: {data.get('AI要約', '')}"
+
+        def show_topic(data, target_topic, topic_label):
+            content = data.get(target_topic, "")
+            if is_missing_value(content):
+                prefetch = st.session_state.get("detail_prefetch")
+                if prefetch and prefetch.is_running(data["金融機関名"], topic_label):
+                    st.session_state.display_title = f"⏳ {topic_label} (取得中)"
+                    st.session_state.display_result = (
+                        "バックグラウンドで調査中です。完了すると自動で表示されます。"
+                    )
+                    st.session_state.pending_topic = topic_label
+                    return
+                # 本文は詳細パネルの結果欄に届いた分から流し込む
+                st.session_state.detail_stream = (topic_label, False)
                 st.session_state.display_result = (
-                    "下のボタンから詳細を選択してください。"
+                    f"Webで「{topic_label}」を再調査しています..."
                 )
+                st.session_state.display_title = f"✅ {topic_label} (Web取得)"
+                st.session_state.web_topic = topic_label
             else:
-                st.session_state.display_title = "❌ エラー"
-                st.session_state.display_result = "情報が見つかりませんでした。"
+                st.session_state.display_title = f"✅ {topic_label}"
+                st.session_state.display_result = content
 
-    def handle_input(user_text):
-        found_candidates = []
-        full_match_found = False
-        if df is not None:
-            # ★ここで空のデータをしっかり除去してリスト化する
-            all_banks = [
-                b for b in df["金融機関名"].tolist() if b and str(b).strip() != ""
-            ]
+        # 結果欄。先読み中の項目を待っている間は、ここだけ1秒ごとに再実行して差し替える
+        def detail_result(data):
+            # 選び直した後に、残ったタイマーで前の銀行の結果欄を描かない
+            if st.session_state.current_bank_data is not data:
+                return
+            topic_label = st.session_state.get("pending_topic")
+            prefetch = st.session_state.get("detail_prefetch")
+            if topic_label and not (
+                prefetch and prefetch.is_running(data["金融機関名"], topic_label)
+            ):
+                st.session_state.pending_topic = None
+                target_topic = next(
+                    col for _, col, t in TOPIC_BUTTONS if t == topic_label
+                )
+                show_topic(data, target_topic, topic_label)
+            if not st.session_state.display_result:
+                return
+            with st.container(border=True):
+                st.markdown(f"#### {st.session_state.display_title}")
+                result_area = st.empty()
+                result_area.markdown(st.session_state.display_result)
+                stream_request = st.session_state.pop("detail_stream", None)
+                if stream_request:
+                    st.session_state.display_result = write_stream_to(
+                        result_area,
+                        stream_specific_detail(data["金融機関名"], *stream_request),
+                    )
+                web_topic = st.session_state.get("web_topic")
+                if web_topic and st.button("🔄 キャッシュを使わず再調査"):
+                    result_area.markdown(f"Webで「{web_topic}」を再調査しています...")
+                    st.session_state.display_result = write_stream_to(
+                        result_area,
+                        stream_specific_detail(
+                            data["金融機関名"], web_topic, refresh=True
+                        ),
+                    )
 
-            if user_text in all_banks:
-                found_candidates = [user_text]
-                full_match_found = True
+        # 詳細パネル: 項目ボタンを押してもここだけ再実行される
+        @st.fragment
+        def bank_detail_panel():
+            if not st.session_state.current_bank_data:
+                st.info("👆 上のリストから銀行を選択するか、検索してください。")
+                return
+            if st.session_state.get("scroll_pending"):
+                st.session_state.scroll_pending = False
+                scroll_to_results()
+            data = st.session_state.current_bank_data
+            st.subheader(f"🏦 {data['金融機関名']}")
+
+            clicked = None
+            button_cols = st.columns(4) + st.columns(4)
+            for col, (label, target_topic, topic_label) in zip(
+                button_cols, TOPIC_BUTTONS
+            ):
+                if col.button(label, use_container_width=True):
+                    clicked = (target_topic, topic_label)
+            if button_cols[-1].button("💡 全て表示", use_container_width=True):
+                clicked = ("ALL", "")
+
+            if clicked:
+                st.session_state.web_topic = None
+                st.session_state.pending_topic = None
+                if clicked[0] == "ALL":
+                    show_all_topics(data)
+                else:
+                    show_topic(data, *clicked)
+
+            # 同じ位置に毎回置く (先読み待ちの時だけ定期実行を付ける。タイマーは
+            # 次の全体再実行まで残るが、その間も同じ結果欄を描き直すだけで済む)
+            st.fragment(
+                detail_result,
+                run_every=1 if st.session_state.get("pending_topic") else None,
+            )(data)
+            if data.get("WebサイトURL"):
+                st.link_button("🔗 公式サイトを開く", data["WebサイトURL"])
+
+        def change_grid_page(delta):
+            st.session_state.grid_page += delta
+
+        # 検索・一覧: 銀行を選んでもページ全体ではなくここだけ再実行される
+        @st.fragment
+        def bank_browser():
+            st.write("▼ **銀行を検索・選択**")
+            search_query = st.text_input(
+                "🔍 銀行名を入力 (Enterで検索)", key="main_search_bar"
+            )
 
-            if not full_match_found:
-                search_key = (
-                    user_text.replace("手続き", "")
-                    .replace("教えて", "")
-                    .replace("銀行", "")
-                    .strip()
-                )
-                for bank in all_banks:
-                    if (bank in user_text) or (
-                        len(search_key) > 1 and search_key.lower() in bank.lower()
-                    ):
-                        found_candidates.append(bank)
-                found_candidates = list(set(found_candidates))
-
-        if len(found_candidates) == 1:
-            select_bank(found_candidates[0])
-        elif len(found_candidates) > 1:
-            st.session_state.candidate_list = found_candidates
-            st.session_state.current_bank_data = None
-            st.session_state.display_title = "🤔 複数の候補があります"
-            st.session_state.display_result = "上のリストから選択してください。"
-        else:
-            select_bank(user_text)
-
-    # UI
-    st.write("▼ **銀行を検索・選択**")
-    search_query = st.text_input("🔍 銀行名を入力 (Enterで検索)", key="main_search_bar")
-    focus_search_input()
-
-    visible_banks = []
-    if df is not None:
-        # ★ここでも空データ除去
-        all_banks = [b for b in df["金融機関名"].tolist() if b and str(b).strip() != ""]
-        if search_query:
-            s_key = search_query.strip().lower()
-            visible_banks = [b for b in all_banks if s_key in b.lower()]
-        else:
-            visible_banks = all_banks
-
-    # グリッド表示（スクロールボックスを廃止して全表示）
-    if visible_banks:
-        # 4列でボタン配置
-        cols = st.columns(4)
-        for idx, b_name in enumerate(visible_banks):
-            if cols[idx % 4].button(b_name, key=f"nav_{idx}", use_container_width=True):
-                select_bank(b_name)
-                st.rerun()
-    else:
-        st.caption("※ 登録された銀行がありません。")
+            visible_banks = []
+            if store is not None:
+                bank_index = store.search_index
+                if search_query:
+                    visible_banks = bank_index.search(search_query)
+                else:
+                    visible_banks = bank_index.names
+
+            if st.session_state.get("grid_query") != search_query:
+                st.session_state.grid_query = search_query
+                st.session_state.grid_page = 0
+            page_count = max(1, math.ceil(len(visible_banks) / BANKS_PER_PAGE))
+            grid_page = min(st.session_state.get("grid_page", 0), page_count - 1)
+            st.session_state.grid_page = grid_page
+
+            if visible_banks:
+                if page_count > 1:
+                    nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+                    nav_prev.button(
+                        "◀ 前へ",
+                        disabled=grid_page == 0,
+                        on_click=change_grid_page,
+                        args=(-1,),
+                        use_container_width=True,
+                    )
+                    nav_info.caption(
+                        f"{grid_page + 1} / {page_count} ページ (全 {len(visible_banks)} 件)"
+                    )
+                    nav_next.button(
+                        "次へ ▶",
+                        disabled=grid_page >= page_count - 1,
+                        on_click=change_grid_page,
+                        args=(1,),
+                        use_container_width=True,
+                    )
+                page_banks = visible_banks[
+                    grid_page * BANKS_PER_PAGE : (grid_page + 1) * BANKS_PER_PAGE
+                ]
+                # 4列でボタン配置
+                cols = st.columns(4)
+                for idx, b_name in enumerate(page_banks):
+                    cols[idx % 4].button(
+                        b_name,
+                        key=f"nav_{b_name}",
+                        on_click=select_bank,
+                        args=(b_name,),
+                        use_container_width=True,
+                    )
+            else:
+                st.caption("※ 登録された銀行がありません。")
 
-    if search_query and not st.session_state.candidate_list:
-        if (
-            not st.session_state.current_bank_data
-            or st.session_state.current_bank_data["金融機関名"] != search_query
-        ):
-            if not visible_banks:
+            # 一覧に出ない入力は1回だけWeb調査に回す
+            if (
+                search_query
+                and not visible_banks
+                and st.session_state.get("handled_query") != search_query
+            ):
+                st.session_state.handled_query = search_query
                 handle_input(search_query)
-                st.rerun()
 
-    if st.session_state.candidate_list:
-        st.info("👇 以下の候補から選択してください")
-        cands = st.session_state.candidate_list
-        c_cols = st.columns(4)
-        for idx, cand in enumerate(cands):
-            if c_cols[idx % 4].button(
-                cand, key=f"cand_{cand}", use_container_width=True
+            if st.session_state.candidate_list:
+                st.info("👇 以下の候補から選択してください")
+                c_cols = st.columns(4)
+                for idx, cand in enumerate(st.session_state.candidate_list):
+                    c_cols[idx % 4].button(
+                        cand,
+                        key=f"cand_{cand}",
+                        on_click=select_bank,
+                        args=(cand,),
+                        use_container_width=True,
+                    )
+
+            st.markdown("---")
+            st.markdown('<div id="result_anchor"></div>', unsafe_allow_html=True)
+            bank_detail_panel()
+
+        # UI
+        focus_search_input()
+        bank_browser()
+
+    # ------------------------------------------------------------
+    # PAGE 2: マスタ管理
+    # ------------------------------------------------------------
+    elif page == "📝 マスタ管理・更新 (管理者用)":
+        st.title("📝 銀行マスタ管理画面")
+        llm_stats = get_llm_cache().stats()
+        st.caption(
+            f"LLMキャッシュ: ヒット {llm_stats['hits']} / ミス {llm_stats['misses']} / "
+            f"{llm_stats['entries']}件 ({llm_stats['bytes'] // 1024} KB)"
+        )
+        search_stats = get_web_search().stats()
+        st.caption(
+            f"Web検索: 要求 {search_stats['requests']} / ヒット {search_stats['hits']} / "
+            f"集約 {search_stats['coalesced']} / 実検索 {search_stats['searches']} "
+            f"(平均 {search_stats['avg_latency']} 秒) / 再試行 {search_stats['retries']} / "
+            f"失敗 {search_stats['errors']}"
+        )
+        if os.path.exists(SERVICE_ACCOUNT_FILE):
+            conn = get_sheet_connection()
+            replica = get_master_replica()
+            st.caption(
+                f"シート接続: 接続から {conn.age_seconds()} 秒 / 再接続 {conn.reconnects} 回"
+            )
+            synced = (
+                datetime.datetime.fromtimestamp(replica.last_sync_at).strftime(
+                    "%H:%M:%S"
+                )
+                if replica.last_sync_at
+                else "未同期"
+            )
+            st.caption(
+                f"ローカル複製: 最終同期 {synced}"
+                + (" / シート未反映の変更あり" if replica.is_pending() else "")
+                + (f" / エラー: {replica.last_error}" if replica.last_error else "")
+            )
+        with st.expander("🔑 APIキー状況"):
+            st.dataframe(pd.DataFrame(get_key_scheduler().stats()), hide_index=True)
+        with st.expander("⏱️ 処理時間の内訳"):
+            metrics_panel()
+        if df is not None and (df.empty or "凍結方法" not in df.columns):
+            bank_names = list(BANK_MASTER_DB.keys())
+            init_urls = [BANK_MASTER_DB[name] for name in bank_names]
+            df = pd.DataFrame(columns=COLS)
+            df["金融機関名"] = bank_names
+            df["WebサイトURL"] = init_urls
+            df = df.fillna("")
+            save_master_data(df)
+            st.rerun()
+
+        jobs = get_bulk_refresh_jobs()
+
+        # どのセッションからでも実行中ジョブの進捗が見える (2秒ごとにここだけ更新)
+        @st.fragment(run_every=2)
+        def bulk_job_progress():
+            job = jobs.latest_job()
+            if job is None:
+                st.caption("実行履歴はまだありません。")
+                return
+            st.progress(job["done"] / job["total"] if job["total"] else 0.0)
+            st.text(
+                f"ジョブ {job['id']} [{job['status']}] {job['done']}/{job['total']} "
+                f"最終: {job['last_bank']}"
+            )
+            st.caption(
+                f"再抽出: {job['extracted']}件 / 変更なしスキップ: {job['skipped']}件 / "
+                f"失敗: {job['failed']}件"
+                + (f" / エラー: {job['error']}" if job["error"] else "")
+            )
+            if job["status"] == "running":
+                st.button("⏹ 中止", on_click=jobs.cancel, args=(job["id"],))
+            elif job["status"] in ["cancelled", "interrupted", "failed"]:
+                st.button(
+                    "▶ 続きから再開",
+                    on_click=jobs.start,
+                    kwargs={"resume_id": job["id"]},
+                )
+            # ジョブが終わったら一覧を最新にするため全体を再実行
+            previous = st.session_state.get("seen_job_status")
+            st.session_state.seen_job_status = (job["id"], job["status"])
+            if (
+                previous
+                and previous[0] == job["id"]
+                and previous[1] == "running"
+                and job["status"] != "running"
             ):
-                select_bank(cand)
                 st.rerun()
 
-    st.markdown("---")
-    st.markdown('<div id="result_anchor"></div>', unsafe_allow_html=True)
-
-    if st.session_state.current_bank_data:
-        scroll_to_results()
-        data = st.session_state.current_bank_data
-        st.subheader(f"🏦 {data['金融機関名']}")
-
-        b1, b2, b3, b4 = st.columns(4)
-        b5, b6, b7, b8 = st.columns(4)
-
-        target_topic = None
-        topic_label = ""
-        if b1.button("📞 連絡先", use_container_width=True):
-            target_topic = "電話番号"
-            topic_label = "相続センター電話番号"
-        if b2.button("🧊 凍結手続", use_container_width=True):
-            target_topic = "凍結方法"
-            topic_label = "口座凍結の手続き"
-        if b3.button("📄 残高証明", use_container_width=True):
-            target_topic = "残高証明"
-            topic_label = "残高証明書の発行"
-        if b4.button("📊 取引明細", use_container_width=True):
-            target_topic = "取引明細"
-            topic_label = "取引推移証明書の発行"
-        if b5.button("🚪 解約手続", use_container_width=True):
-            target_topic = "解約手続"
-            topic_label = "相続預金の解約手続"
-        if b6.button("📈 投信国債", use_container_width=True):
-            target_topic = "投信国債"
-            topic_label = "投資信託・国債の相続"
-        if b7.button("🔐 貸金庫", use_container_width=True):
-            target_topic = "貸金庫"
-            topic_label = "貸金庫の相続手続"
-        if b8.button("💡 全て表示", use_container_width=True):
-            target_topic = "ALL"
-
-        if target_topic:
-            if target_topic == "ALL":
-                st.session_state.display_title = "💡 全情報"
-                st.session_state.display_result = f"**📞 連絡先**: {data.get('電話番号', '')}\n**🧊 凍結**: {data.get('凍結方法', '')}\n**📄 残高証明**: {data.get('残高証明', '')}\n**📊 取引明細**: {data.get('取引明細', '')}\n**🚪 解約**: {data.get('解約手続', '')}\n**📈 投信**: {data.get('投信国債', '')}\n**🔐 貸金庫**: {data.get('貸金庫', '')}\n**💡 要約**: {data.get('AI要約', '')}"
-            else:
-                content = data.get(target_topic, "")
-                if not content or content in ["", "記載なし", "不明"]:
-                    st.session_state.display_title = f"🔍 {topic_label} (Web調査中...)"
-                    with st.spinner(f"Webで「{topic_label}」を再調査しています..."):
-                        fetched_info = fetch_specific_detail(
-                            data["金融機関名"], topic_label
+        with st.expander(
+            "🚀 データ一括更新パネル", expanded=jobs.running_job_id() is not None
+        ):
+            if st.button("全銀行更新 (Cloud)", type="primary"):
+                if df is not None:
+                    jobs.start()
+            if jobs.schedule_error:
+                st.error(f"定期実行を開始できません: {jobs.schedule_error}")
+            elif BULK_REFRESH_SCHEDULE:
+                st.caption(f"定期実行: 毎日 {BULK_REFRESH_SCHEDULE}")
+            bulk_job_progress()
+
+        with st.expander("📥 Excelから一括取り込み"):
+            st.caption(
+                "1行目が見出しのExcel (金融機関名・WebサイトURL・電話番号・AI要約など) を"
+                "金融機関名で突き合わせ、追加・変更のあった行だけ反映します。"
+            )
+            uploaded = st.file_uploader("Excelファイル", type=["xlsx"])
+            sources = (
+                [("アップロードしたファイルを取り込む", uploaded)] if uploaded else []
+            )
+            if os.path.exists(BANK_MASTER_XLSX):
+                sources.append(
+                    (f"同梱の {BANK_MASTER_XLSX} を取り込む", BANK_MASTER_XLSX)
+                )
+            for label, source in sources:
+                if st.button(label):
+                    try:
+                        with st.spinner("取り込み中..."):
+                            result = import_master_workbook(source)
+                    except Exception as e:
+                        st.error(f"取り込みに失敗しました: {e}")
+                    else:
+                        st.success(
+                            f"{result['rows']}行を読み込み: 追加 {result['added']}件 / "
+                            f"更新 {result['changed']}件"
                         )
-                        st.session_state.display_result = fetched_info
-                        st.session_state.display_title = f"✅ {topic_label} (Web取得)"
-                else:
-                    st.session_state.display_title = f"✅ {topic_label}"
-                    st.session_state.display_result = content
-            st.rerun()
+                        df = get_master_data()
 
-        if st.session_state.display_result:
-            with st.container(border=True):
-                st.markdown(f"#### {st.session_state.display_title}")
-                st.markdown(st.session_state.display_result)
-        if data.get("WebサイトURL"):
-            st.link_button("🔗 公式サイトを開く", data["WebサイトURL"])
-    else:
-        st.info("👆 上のリストから銀行を選択するか、検索してください。")
-
-# ------------------------------------------------------------
-# PAGE 2: マスタ管理
-# ------------------------------------------------------------
-elif page == "📝 マスタ管理・更新 (管理者用)":
-    st.title("📝 銀行マスタ管理画面")
-    COLS = [
-        "金融機関名",
-        "WebサイトURL",
-        "電話番号",
-        "凍結方法",
-        "残高証明",
-        "取引明細",
-        "解約手続",
-        "投信国債",
-        "貸金庫",
-        "AI要約",
-        "最終更新",
-    ]
-    if df is not None and (df.empty or "凍結方法" not in df.columns):
-        bank_names = list(BANK_MASTER_DB.keys())
-        init_urls = [BANK_MASTER_DB[name] for name in bank_names]
-        df = pd.DataFrame(columns=COLS)
-        df["金融機関名"] = bank_names
-        df["WebサイトURL"] = init_urls
-        df = df.fillna("")
-        if worksheet:
-            save_to_google_sheet(worksheet, df)
-            st.cache_data.clear()
-            st.rerun()
+        if df is not None:
+            cfg = {
+                "WebサイトURL": st.column_config.LinkColumn("URL"),
+                "電話番号": st.column_config.TextColumn("電話", width="medium"),
+                "AI要約": st.column_config.TextColumn("要約", width="medium"),
+            }
+            st.dataframe(df, column_config=cfg, use_container_width=True, height=300)
 
-    with st.expander("🚀 データ一括更新パネル"):
-        if st.button("全銀行更新 (Cloud)", type="primary"):
-            if df is not None and worksheet is not None:
-                total = len(df)
-                bar = st.progress(0)
-                status = st.empty()
-                for i, row in df.iterrows():
-                    bank = row["金融機関名"]
-                    status.text(f"調査中: {bank} ...")
-                    res_data, stat = update_bank_data_smart(bank, row["WebサイトURL"])
-                    if stat in ["Success", "Fallback"] and res_data:
-                        for k in COLS:
-                            if k in res_data:
-                                df.at[i, k] = res_data[k]
-                    import datetime
-
-                    df.at[i, "最終更新"] = datetime.datetime.now().strftime(
-                        "%Y-%m-%d %H:%M"
-                    )
-                    if (i + 1) % 3 == 0:
-                        save_to_google_sheet(worksheet, df)
-                        time.sleep(1)
-                    bar.progress((i + 1) / total)
-                save_to_google_sheet(worksheet, df)
-                status.success("完了！")
-                st.cache_data.clear()
-                st.rerun()
+    record_script_run()
 
-    if df is not None:
-        cfg = {
-            "WebサイトURL": st.column_config.LinkColumn("URL"),
-            "電話番号": st.column_config.TextColumn("電話", width="medium"),
-            "AI要約": st.column_config.TextColumn("要約", width="medium"),
-        }
-        st.dataframe(df, column_config=cfg, use_container_width=True, height=300)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app はモジュール読み込み時にキャッシュ・計測ログの置き場所を決めるので、先に差し替える
+os.environ.setdefault("APP_CACHE_DIR", tempfile.mkdtemp(prefix="bank-app-test-"))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+# 外部サービスの代役はベンチマークと共有する (benchmarks/stubs.py)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
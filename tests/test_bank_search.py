@@ -0,0 +1,38 @@
+import app
+
+NAMES = ["三菱UFJ銀行", "三井住友銀行", "みずほ銀行", "りそな銀行", "埼玉りそな銀行"]
+
+
+def search(query):
+    return app.BankSearchIndex(NAMES).search(query)
+
+
+def test_exact_match_ignores_width_and_kana():
+    assert search("ミズホ銀行") == ["みずほ銀行"]
+    assert search("三菱ＵＦＪ銀行") == ["三菱UFJ銀行"]
+
+
+def test_partial_input_finds_bank():
+    assert search("ufj") == ["三菱UFJ銀行"]
+
+
+def test_query_with_request_words_finds_bank():
+    assert search("みずほ銀行の相続手続きを教えて") == ["みずほ銀行"]
+
+
+def test_ambiguous_input_returns_candidates():
+    assert set(search("りそな")) == {"りそな銀行", "埼玉りそな銀行"}
+
+
+def test_unknown_input_returns_nothing():
+    assert search("存在しない信用組合") == []
+
+
+def test_romaji_input_matches_kana_names():
+    index = app.BankSearchIndex(NAMES + ["ゆうちょ銀行"])
+    assert index.search("mizuho") == ["みずほ銀行"]
+    assert index.search("yuucho") == ["ゆうちょ銀行"]
+
+
+def test_limit_keeps_best_candidates():
+    assert app.BankSearchIndex(NAMES).search("りそな", limit=1) == ["りそな銀行"]
@@ -0,0 +1,134 @@
+import functools
+import threading
+
+import pandas as pd
+import pytest
+
+import app
+
+BANKS = [f"銀行{i}" for i in range(6)]
+
+
+class FakeRefresh:
+    # update_bank_data_smart の代役。hold を立てると release されるまで戻らない
+    def __init__(self):
+        self.started = []
+        self.hold = False
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+        self.two_running = threading.Event()
+
+    def __call__(self, bank_name, existing_url, prev=None, log=None):
+        with self._lock:
+            self.started.append(bank_name)
+            if len(self.started) == 2:
+                self.two_running.set()
+        if self.hold:
+            self.release.wait(5)
+        return {"金融機関名": bank_name, "電話番号": f"{bank_name}-new"}, "Success"
+
+
+@pytest.fixture
+def refresh(monkeypatch):
+    fake = FakeRefresh()
+    monkeypatch.setattr(app, "update_bank_data_smart", fake)
+    monkeypatch.setattr(
+        app,
+        "refresh_banks_concurrently",
+        functools.partial(app.refresh_banks_concurrently, workers=2),
+    )
+    return fake
+
+
+@pytest.fixture
+def replica(tmp_path):
+    replica = app.MasterReplica(str(tmp_path / "master.sqlite3"))
+    replica.write_local(pd.DataFrame({"金融機関名": BANKS, "電話番号": ""}))
+    return replica
+
+
+def make_jobs(tmp_path, replica):
+    pushes = []
+    jobs = app.BulkRefreshJobs(
+        str(tmp_path / "jobs.sqlite3"), replica, lambda: pushes.append(1)
+    )
+    jobs.pushes = pushes
+    return jobs
+
+
+def run_to_end(jobs, job_id):
+    thread = jobs._threads.get(job_id)
+    if thread:
+        thread.join(10)
+    return jobs.latest_job()
+
+
+def phones(replica):
+    df = replica.load_frame()
+    return dict(zip(df["金融機関名"], df["電話番号"]))
+
+
+def test_job_refreshes_every_bank_and_saves_in_batches(tmp_path, replica, refresh):
+    jobs = make_jobs(tmp_path, replica)
+    job = run_to_end(jobs, jobs.start())
+    assert (job["status"], job["total"], job["extracted"]) == ("completed", 6, 6)
+    assert phones(replica) == {b: f"{b}-new" for b in BANKS}
+    assert len(jobs.pushes) == len(BANKS) // app.JOB_SAVE_EVERY
+
+
+def test_start_while_running_returns_the_running_job(tmp_path, replica, refresh):
+    refresh.hold = True
+    jobs = make_jobs(tmp_path, replica)
+    job_id = jobs.start()
+    assert jobs.start() == job_id
+    refresh.release.set()
+    run_to_end(jobs, job_id)
+
+
+def test_cancel_keeps_results_of_banks_already_running(tmp_path, replica, refresh):
+    refresh.hold = True
+    jobs = make_jobs(tmp_path, replica)
+    job_id = jobs.start()
+    thread = jobs._threads[job_id]
+    assert refresh.two_running.wait(5)
+    jobs.cancel(job_id)
+    # 実行中の銀行が終わるまではジョブも終わらない
+    thread.join(0.2)
+    assert thread.is_alive()
+    refresh.release.set()
+    job = run_to_end(jobs, job_id)
+    running = refresh.started[:2]
+    assert job["status"] == "cancelled"
+    assert refresh.started == running
+    assert {bank for bank, *_ in jobs._items(job_id)} == set(running)
+    assert {b for b, p in phones(replica).items() if p} == set(running)
+
+
+def test_resume_skips_banks_already_done(tmp_path, replica, refresh):
+    refresh.hold = True
+    jobs = make_jobs(tmp_path, replica)
+    job_id = jobs.start()
+    assert refresh.two_running.wait(5)
+    jobs.cancel(job_id)
+    refresh.release.set()
+    run_to_end(jobs, job_id)
+    done = set(refresh.started)
+
+    assert jobs.start(resume_id=job_id) == job_id
+    job = run_to_end(jobs, job_id)
+    assert job["status"] == "completed"
+    assert sorted(refresh.started) == sorted(BANKS)
+    assert set(refresh.started[len(done) :]).isdisjoint(done)
+    assert job["done"] == job["total"] == len(BANKS)
+
+
+def test_job_interrupted_by_restart_resumes_on_startup(tmp_path, replica, refresh):
+    jobs = make_jobs(tmp_path, replica)
+    jobs._query(
+        "INSERT INTO jobs VALUES ('j1', 'running', 'manual', 6, '', 0, 0)",
+    )
+    jobs._query("INSERT INTO job_items VALUES ('j1', ?, 'Success', '', 0)", (BANKS[0],))
+    restarted = make_jobs(tmp_path, replica)
+    job = run_to_end(restarted, "j1")
+    assert job["status"] == "completed"
+    assert sorted(refresh.started) == sorted(BANKS[1:])
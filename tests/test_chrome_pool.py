@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import app
+
+
+class FakeDriver:
+    def __init__(self, slot):
+        self.slot = slot
+        self.alive = True
+        self.quit_called = False
+        self.cdp_commands = []
+        self.urls = []
+
+    def execute_script(self, script):
+        if not self.alive:
+            raise RuntimeError("chrome not reachable")
+        return 1
+
+    def execute_cdp_cmd(self, cmd, params):
+        if not self.alive:
+            raise RuntimeError("chrome not reachable")
+        self.cdp_commands.append(cmd)
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    created = []
+
+    def create(cache_slot=None):
+        created.append(FakeDriver(cache_slot))
+        return created[-1]
+
+    monkeypatch.setattr(app, "create_chrome_driver", create)
+    pool = app.ChromeDriverPool(max_size=2, max_pages=3)
+    pool.created = created
+    return pool
+
+
+def test_released_driver_is_reused_with_cookies_cleared(pool):
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert first.cdp_commands == ["Network.clearBrowserCookies"]
+    assert first.urls == ["about:blank"]
+    assert pool.status()["created"] == 1
+
+
+def test_driver_is_recycled_after_max_pages(pool):
+    for _ in range(3):
+        driver = pool.acquire()
+        pool.release(driver)
+    assert driver.quit_called
+    assert pool.status()["recycled"] == 1
+    replacement = pool.acquire()
+    assert replacement is not driver
+    assert replacement.slot == driver.slot
+
+
+def test_concurrent_drivers_get_distinct_cache_slots(pool):
+    a, b = pool.acquire(), pool.acquire()
+    assert {a.slot, b.slot} == {0, 1}
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+
+
+def test_waiting_acquire_gets_released_driver(pool):
+    a = pool.acquire()
+    pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=2)))
+    waiter.start()
+    pool.release(a)
+    waiter.join()
+    assert got == [a]
+    assert pool.status()["size"] == 2
+
+
+def test_crashed_driver_is_replaced_and_its_slot_freed(pool):
+    driver = pool.acquire()
+    driver.alive = False
+    pool.release(driver)
+    assert driver.quit_called
+    assert pool.status()["crashed"] == 1
+    assert pool.status()["size"] == 0
+    assert pool.acquire().slot == driver.slot
+
+
+def test_idle_driver_that_died_is_replaced_on_acquire(pool):
+    driver = pool.acquire()
+    pool.release(driver)
+    driver.alive = False
+    replacement = pool.acquire()
+    assert replacement is not driver
+    assert pool.status()["crashed"] == 1
+
+
+def test_close_all_quits_idle_drivers(pool):
+    a, b = pool.acquire(), pool.acquire()
+    pool.release(a)
+    pool.close_all()
+    assert a.quit_called and not b.quit_called
+    assert pool.status()["size"] == 1
+    assert pool.acquire().slot == a.slot
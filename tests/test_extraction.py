@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+import app
+
+
+def test_validate_extraction_keeps_valid_fields_and_reports_missing():
+    data = {
+        "contact_phone": "0120-000-000",
+        "freeze_method": "",
+        "balance_cert": app.EXTRACT_FIELDS["balance_cert"],
+        "transaction_history": 123,
+    }
+    valid, missing = app.validate_extraction(data)
+    assert valid == {
+        "contact_phone": "0120-000-000",
+        "freeze_method": app.EXTRACT_MISSING,
+        "transaction_history": "123",
+    }
+    assert "balance_cert" in missing
+    assert set(valid) | set(missing) == set(app.EXTRACT_FIELDS)
+
+
+def test_validate_extraction_rejects_non_dict():
+    valid, missing = app.validate_extraction(None)
+    assert valid == {}
+    assert missing == list(app.EXTRACT_FIELDS)
+
+
+def test_extract_json_skips_prose_and_fences():
+    text = '説明です {壊れた\n```json\n{"summary": "要約"}\n```'
+    assert app.extract_json_from_text(text) == {"summary": "要約"}
+
+
+def test_extract_json_returns_none_for_truncated_json():
+    text = json.dumps({"summary": "要約", "investment": "記載なし"})[:-5]
+    assert app.extract_json_from_text(text) is None
+    assert app.extract_json_from_text("") is None
+
+
+def test_extraction_config_requires_requested_fields():
+    config = app.extraction_config(["summary", "investment"])
+    schema = config["response_schema"]
+    assert config["response_mime_type"] == "application/json"
+    assert schema["required"] == ["summary", "investment"]
+    assert set(schema["properties"]) == {"summary", "investment"}
+
+
+class FakeStream:
+    # stream_ultimate_rotation の代役。呼ばれるたびに responses の先頭を流す
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, prompt, use_cache=True, *args):
+        self.calls.append((prompt, use_cache))
+        response = self.responses.pop(0)
+        if response is None:
+            yield app.STREAM_FAILED
+            yield "エラー: 生成失敗"
+        else:
+            yield response
+
+
+def answer(**fields):
+    return json.dumps(fields, ensure_ascii=False)
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    def install(*responses):
+        fake = FakeStream(responses)
+        monkeypatch.setattr(app, "stream_ultimate_rotation", fake)
+        return fake
+
+    return install
+
+
+def test_generation_failure_is_reported_as_none(stream):
+    stream(None)
+    assert app.generate_ultimate_rotation("質問") is None
+
+
+def test_failed_generation_is_not_asked_again(stream):
+    fake = stream(None)
+    assert app.ask_gemini_to_extract_7points("本文") == ""
+    assert len(fake.calls) == 1
+
+
+def test_only_missing_fields_are_asked_again(stream):
+    full = {f: "値" for f in app.EXTRACT_FIELDS}
+    first = dict(full)
+    del first["summary"]
+    fake = stream(answer(**first), answer(summary="要約"))
+    data = json.loads(app.ask_gemini_to_extract_7points("本文"))
+    assert data == {**full, "summary": "要約"}
+    prompt, use_cache = fake.calls[1]
+    assert "summary" in prompt and "contact_phone" not in prompt
+    assert use_cache
+
+
+def test_unparseable_answer_is_asked_again_without_cache(stream):
+    full = {f: "値" for f in app.EXTRACT_FIELDS}
+    fake = stream('{"summary": "途中で', answer(**full))
+    assert json.loads(app.ask_gemini_to_extract_7points("本文")) == full
+    assert [use_cache for _, use_cache in fake.calls] == [True, False]
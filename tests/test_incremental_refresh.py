@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+
+import app
+
+PAGE = "相続のお手続きは来店予約のうえ、お近くの支店までお越しください。"
+
+
+def master(**columns):
+    df = pd.DataFrame({c: [""] * len(columns["金融機関名"]) for c in app.COLS})
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    def ask(text, is_html=True):
+        calls.append(text)
+        return '{"summary": "要約"}'
+
+    monkeypatch.setattr(app, "ask_gemini_to_extract_7points", ask)
+    return calls
+
+
+def serve(monkeypatch, page):
+    requests = []
+
+    def fetch(target_url, etag="", last_modified=""):
+        requests.append((etag, last_modified))
+        return page
+
+    monkeypatch.setattr(app, "fetch_text_with_http", fetch)
+    return requests
+
+
+def test_fingerprint_ignores_whitespace_and_width():
+    assert app.content_fingerprint("ＡＢＣ　銀行\n") == app.content_fingerprint(
+        "ABC銀行"
+    )
+    assert app.content_fingerprint("A銀行") != app.content_fingerprint("B銀行")
+
+
+def test_not_modified_response_skips_extraction(monkeypatch, llm_calls):
+    sent = serve(monkeypatch, app.HttpPage(etag='"e"', not_modified=True))
+    prev = {"コンテンツハッシュ": "h", "ETag": '"e"', "Last-Modified": "Mon"}
+    _, status, meta = app.scrape_and_extract("https://bank.example", prev)
+    assert status == "Unchanged"
+    assert sent == [('"e"', "Mon")]
+    assert meta["コンテンツハッシュ"] == "h"
+    assert llm_calls == []
+
+
+def test_validators_are_not_sent_without_a_previous_hash(monkeypatch, llm_calls):
+    sent = serve(monkeypatch, app.HttpPage(text=PAGE))
+    app.scrape_and_extract("https://bank.example", {"ETag": '"e"'})
+    assert sent == [("", "")]
+
+
+def test_same_text_skips_extraction(monkeypatch, llm_calls):
+    serve(monkeypatch, app.HttpPage(text=PAGE, etag='"new"'))
+    prev = {"コンテンツハッシュ": app.content_fingerprint(PAGE)}
+    _, status, meta = app.scrape_and_extract("https://bank.example", prev)
+    assert status == "Unchanged"
+    assert meta["ETag"] == '"new"'
+    assert llm_calls == []
+
+
+def test_changed_text_is_extracted(monkeypatch, llm_calls):
+    serve(monkeypatch, app.HttpPage(text=PAGE))
+    prev = {"コンテンツハッシュ": app.content_fingerprint("前回の本文")}
+    json_text, status, meta = app.scrape_and_extract("https://bank.example", prev)
+    assert (json_text, status) == ('{"summary": "要約"}', "Success")
+    assert meta["コンテンツハッシュ"] == app.content_fingerprint(PAGE)
+    assert llm_calls == [PAGE]
+
+
+def test_unchanged_refresh_only_updates_validators():
+    df = master(
+        金融機関名=["A銀行"], 凍結方法=["電話"], 最終更新=["前回"], ETag=['"old"']
+    )
+    result = {"ETag": '"new"', "Last-Modified": "Mon", "コンテンツハッシュ": "h"}
+    out = app.apply_refresh_results(df, [("A銀行", "Unchanged", result, 0)])
+    row = out.iloc[0]
+    assert (row["ETag"], row["Last-Modified"]) == ('"new"', "Mon")
+    assert (row["凍結方法"], row["最終更新"], row["コンテンツハッシュ"]) == (
+        "電話",
+        "前回",
+        "",
+    )
@@ -0,0 +1,81 @@
+from google.api_core import exceptions as google_exceptions
+
+import app
+
+
+def test_token_bucket_refills_over_time():
+    bucket = app.TokenBucket(rate_per_sec=1, capacity=1)
+    now = bucket.updated
+    assert bucket.try_take(now)
+    assert not bucket.try_take(now)
+    assert bucket.wait_time(now) == 1
+    assert bucket.try_take(now + 1)
+
+
+def test_acquire_prefers_idle_keys_and_honours_exclude():
+    scheduler = app.GeminiKeyScheduler(["k0", "k1"], rpm=600)
+    first = scheduler.acquire(timeout=0)
+    second = scheduler.acquire(timeout=0)
+    assert {first.index, second.index} == {0, 1}
+    assert scheduler.acquire(exclude={0, 1}, timeout=0) is None
+
+
+def test_throttled_key_cools_down_with_backoff():
+    scheduler = app.GeminiKeyScheduler(["k0"], rpm=600)
+    key = scheduler.acquire(timeout=0)
+    error = google_exceptions.TooManyRequests("quota")
+    assert scheduler.record_error(key, "m", error, 0.1) == "throttled"
+    first_cooldown = key.cooldown_until
+    assert scheduler.record_error(key, "m", error, 0.1) == "throttled"
+    assert key.cooldown_until > first_cooldown
+    scheduler.release(key)
+    assert scheduler.acquire(timeout=0) is None
+
+
+def test_error_kinds():
+    scheduler = app.GeminiKeyScheduler(["k0"], rpm=600)
+    key = scheduler.acquire(timeout=0)
+    denied = google_exceptions.PermissionDenied("API key not valid")
+    assert scheduler.record_error(key, "m", denied, 0) == "key"
+    missing = google_exceptions.NotFound("no model")
+    assert scheduler.record_error(key, "m", missing, 0) == "model"
+    assert scheduler.is_model_down(key, "m")
+    assert scheduler.record_error(key, "m", ValueError("x"), 0) == "other"
+    scheduler.record_success(key, 0.2)
+    assert key.consecutive_throttles == 0
+
+
+class FakeServiceClient:
+    def __init__(self):
+        self.requests = []
+
+    def stream_generate_content(self, request):
+        self.requests.append(request)
+        return iter([])
+
+
+def test_models_share_one_client_per_key(monkeypatch):
+    glm = app.load_module("google.ai.generativelanguage")
+    monkeypatch.setattr(glm, "GenerativeServiceClient", lambda **_: object())
+    scheduler = app.GeminiKeyScheduler(["k0", "k1"], rpm=600)
+    first = scheduler.acquire(timeout=0)
+    second = scheduler.acquire(timeout=0)
+    model = scheduler.get_model(first, "m1")
+    assert scheduler.get_model(first, "m1") is model
+    assert scheduler.get_model(first, "m2").client is model.client
+    assert scheduler.get_model(second, "m1").client is not model.client
+
+
+def test_model_sends_prompt_and_schema_in_request():
+    client = FakeServiceClient()
+    model = app.GeminiModel(client, "gemini-test")
+    model.generate_content(
+        "質問", generation_config=app.extraction_config(["summary"]), stream=True
+    )
+    (request,) = client.requests
+    assert request.model == "models/gemini-test"
+    assert request.contents[0].parts[0].text == "質問"
+    config = request.generation_config
+    assert config.response_mime_type == "application/json"
+    assert list(config.response_schema.properties) == ["summary"]
+    assert list(config.response_schema.required) == ["summary"]
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def master(tmp_path, monkeypatch):
+    # プロセス共有の複製・マスタ・single-flight をテストごとに作り直す
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    for getter in [
+        app.get_master_replica,
+        app.load_master_store,
+        app.get_live_lookup_flights,
+    ]:
+        getter.clear()
+    yield app.get_master_replica()
+    for getter in [app.get_master_replica, app.load_master_store]:
+        getter.clear()
+
+
+def fake_lookup(monkeypatch, status):
+    calls = []
+
+    def fetch(bank_name):
+        calls.append(bank_name)
+        if status == "失敗":
+            return None, status
+        return {
+            "金融機関名": bank_name,
+            "電話番号": "0120-000-000",
+            "最終更新": app.FALLBACK_UPDATED_MARK if status == "Fallback" else "",
+        }, status
+
+    monkeypatch.setattr(app, "fetch_bank_data_dynamic", fetch)
+    return calls
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flights = app.SingleFlight(2, "test")
+    gate = threading.Event()
+    calls = []
+
+    def work(x):
+        calls.append(x)
+        gate.wait(5)
+        return x * 2
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flights.run("k", work, 21)))
+        for _ in range(3)
+    ]
+    for t in threads:
+        t.start()
+    while flights.coalesced < 2:
+        threads[0].join(0.01)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == [21]
+    assert results == [42, 42, 42]
+    assert (flights.started, flights.coalesced) == (1, 2)
+
+
+def test_single_flight_runs_again_after_completion_and_shares_errors():
+    flights = app.SingleFlight(1, "test")
+    assert flights.run("k", lambda: 1) == 1
+    assert flights.run("k", lambda: 2) == 2
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.run("k", fail)
+    assert flights.started == 3
+
+
+def test_clean_bank_query_strips_request_words_only():
+    assert app.clean_bank_query("○○銀行の手続き教えて") == "○○銀行"
+    assert app.clean_bank_query("ｱｲﾁ銀行の相続手続きを教えて") == "アイチ銀行"
+    assert app.clean_bank_query("JAみどりの") == "JAみどりの"
+    assert app.clean_bank_query("相続") == ""
+
+
+def test_query_without_a_bank_name_is_not_looked_up(master, monkeypatch):
+    calls = fake_lookup(monkeypatch, "Success")
+    assert app.lookup_bank_live("相続手続きについて教えて") == (None, "失敗")
+    assert calls == []
+
+
+@pytest.mark.parametrize("status", ["Success", "Fallback"])
+def test_lookup_result_is_stored_and_reused(master, monkeypatch, status):
+    calls = fake_lookup(monkeypatch, status)
+    data, got = app.lookup_bank_live("テスト信金の手続き教えて")
+    assert (data["金融機関名"], got) == ("テスト信金", status)
+    data, got = app.lookup_bank_live("テスト信金")
+    assert calls == ["テスト信金"]
+    assert (data["電話番号"], got) == ("0120-000-000", status)
+    stored = master.load_frame().iloc[0]
+    assert stored["金融機関名"] == "テスト信金"
+    if status == "Fallback":
+        assert stored["最終更新"] == app.FALLBACK_UPDATED_MARK
+    else:
+        assert stored["最終更新"] not in ("", app.FALLBACK_UPDATED_MARK)
+
+
+def test_failed_lookup_is_not_stored(master, monkeypatch):
+    calls = fake_lookup(monkeypatch, "失敗")
+    app.lookup_bank_live("テスト信金")
+    app.lookup_bank_live("テスト信金")
+    assert len(calls) == 2
+    assert not master.has_data()
@@ -0,0 +1,70 @@
+import pytest
+
+import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, "time", clock)
+    return clock
+
+
+def make_cache(tmp_path, max_bytes=1000):
+    return app.LLMResponseCache(str(tmp_path / "llm.sqlite3"), max_bytes)
+
+
+def test_get_returns_stored_response_until_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put("prompt", "m", "answer", ttl=60)
+    assert cache.get("prompt") == "answer"
+    clock.now += 61
+    assert cache.get("prompt") is None
+    assert cache.stats()["entries"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted_first(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=20)
+    cache.put("a", "m", "x" * 8)
+    clock.now += 1
+    cache.put("b", "m", "y" * 8)
+    clock.now += 1
+    assert cache.get("a") == "x" * 8
+    clock.now += 1
+    cache.put("c", "m", "z" * 8)
+    assert cache.get("b") is None
+    assert cache.get("a") == "x" * 8
+    assert cache.get("c") == "z" * 8
+    assert cache.stats()["bytes"] <= 20
+    assert cache.evictions == 1
+
+
+def test_expired_entries_are_dropped_before_live_ones(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=20)
+    cache.put("old", "m", "x" * 8, ttl=1)
+    clock.now += 1
+    cache.put("recent", "m", "y" * 8)
+    clock.now += 5
+    cache.put("new", "m", "z" * 8)
+    assert cache.get("recent") == "y" * 8
+    assert cache.evictions == 0
+
+
+def test_entries_survive_reopening(tmp_path, clock):
+    make_cache(tmp_path).put("prompt", "m", "answer")
+    assert make_cache(tmp_path).get("prompt") == "answer"
+
+
+def test_key_depends_on_model_candidates(monkeypatch):
+    key = app.LLMResponseCache.make_key("prompt")
+    monkeypatch.setattr(app, "MODEL_CANDIDATES", ["other-model"])
+    assert app.LLMResponseCache.make_key("prompt") != key
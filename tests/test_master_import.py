@@ -0,0 +1,116 @@
+import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import app
+
+
+def master(**columns):
+    df = pd.DataFrame({c: [""] * len(columns["金融機関名"]) for c in app.COLS})
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+def test_normalize_bank_series_matches_normalize_bank_text():
+    names = [
+        "三菱ＵＦＪ銀行",
+        "ミズホ銀行 ",
+        "ゆうちょ_銀行",
+        "ｼｽﾞｵｶ銀行",
+        "JA バンク!",
+    ]
+    expected = [app.normalize_bank_text(n) for n in names]
+    assert list(app.normalize_bank_series(pd.Series(names))) == expected
+
+
+def test_merge_updates_by_normalized_name_and_appends_new_banks():
+    df = master(金融機関名=["ミズホ銀行", "A銀行"], 電話番号=["1", "2"])
+    incoming = pd.DataFrame(
+        {"金融機関名": ["みずほ銀行", "新銀行"], "電話番号": ["9", "3"]}
+    )
+    merged, added, changed = app.merge_master_frame(df, incoming)
+    assert list(merged["金融機関名"]) == ["ミズホ銀行", "A銀行", "新銀行"]
+    assert list(merged["電話番号"]) == ["9", "2", "3"]
+    assert (added, changed) == (1, 1)
+
+
+def test_merge_does_not_overwrite_with_missing_values():
+    df = master(金融機関名=["A銀行"], 電話番号=["1"], AI要約=["要約"])
+    incoming = pd.DataFrame(
+        {"金融機関名": ["A銀行"], "電話番号": [None], "AI要約": ["新しい要約"]}
+    )
+    merged, added, changed = app.merge_master_frame(df, incoming)
+    assert merged.loc[0, "電話番号"] == "1"
+    assert merged.loc[0, "AI要約"] == "新しい要約"
+    assert (added, changed) == (0, 1)
+
+
+def test_merge_keeps_last_duplicate_in_incoming():
+    incoming = pd.DataFrame({"金融機関名": ["B銀行", "Ｂ銀行"], "電話番号": ["1", "2"]})
+    merged, added, _ = app.merge_master_frame(master(金融機関名=[]), incoming)
+    assert added == 1
+    assert merged.loc[0, "電話番号"] == "2"
+
+
+def test_import_frame_masks_placeholders():
+    frame = pd.DataFrame(
+        {
+            "金融機関名": [" りそな銀行 "],
+            "電話番号": ["不明"],
+            "AI要約": ["このサイトにアクセスできません"],
+            "最終更新": ["-"],
+        }
+    )
+    out = app.normalize_import_frame(frame)
+    assert out.loc[0, "金融機関名"] == "りそな銀行"
+    assert out[["電話番号", "AI要約", "最終更新"]].isna().all(axis=None)
+
+
+def workbook(tmp_path, rows):
+    book = openpyxl.Workbook()
+    for row in rows:
+        book.active.append(row)
+    path = tmp_path / "bank_master.xlsx"
+    book.save(path)
+    return str(path)
+
+
+def test_workbook_is_read_in_chunks_of_known_columns(tmp_path):
+    path = workbook(
+        tmp_path,
+        [["金融機関名", "メモ", "電話番号", "最終更新"]]
+        + [[f"銀行{i}", "x", i, datetime.datetime(2026, 1, 2, 3, 4)] for i in range(5)],
+    )
+    frames = list(app.iter_workbook_frames(path, chunk_rows=2))
+    assert [len(f) for f in frames] == [2, 2, 1]
+    assert list(frames[0].columns) == ["金融機関名", "電話番号", "最終更新"]
+    assert frames[2].iloc[0].tolist() == ["銀行4", "4", "2026-01-02 03:04"]
+
+
+def test_workbook_without_bank_name_column_is_rejected(tmp_path):
+    path = workbook(tmp_path, [["名前", "電話番号"], ["A銀行", "1"]])
+    with pytest.raises(ValueError):
+        list(app.iter_workbook_frames(path))
+
+
+def test_import_merges_into_the_replica(tmp_path, monkeypatch):
+    replica = app.MasterReplica(str(tmp_path / "master.sqlite3"))
+    replica.write_local(master(金融機関名=["A銀行"], 電話番号=["1"], AI要約=["要約"]))
+    monkeypatch.setattr(app, "get_master_replica", lambda: replica)
+    path = workbook(
+        tmp_path,
+        [
+            ["金融機関名", "電話番号", "AI要約"],
+            ["Ａ銀行", "9", "不明"],
+            ["B銀行", "2", ""],
+        ],
+    )
+    assert app.import_master_workbook(path) == {"rows": 2, "added": 1, "changed": 1}
+    df = replica.load_frame()
+    assert df[["金融機関名", "電話番号", "AI要約"]].values.tolist() == [
+        ["A銀行", "9", "要約"],
+        ["B銀行", "2", ""],
+    ]
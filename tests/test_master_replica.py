@@ -0,0 +1,116 @@
+import threading
+
+import pandas as pd
+import pytest
+from stubs import InMemorySheetConnection, InMemoryWorksheet, Latency
+
+import app
+
+SHEET = [["金融機関名", "電話番号"], ["A銀行", "1"], ["B銀行", "2"]]
+
+
+@pytest.fixture(autouse=True)
+def fresh_sheet_writers():
+    # 差分書き込みのスナップショットはワークシートIDごとに共有されるので、毎回捨てる
+    app.get_sheet_writer.clear()
+
+
+@pytest.fixture
+def replica(tmp_path):
+    return app.MasterReplica(str(tmp_path / "master.sqlite3"))
+
+
+@pytest.fixture
+def conn():
+    return InMemorySheetConnection(InMemoryWorksheet(SHEET, Latency()))
+
+
+def rows(df):
+    return [list(df.columns)] + df.values.tolist()
+
+
+def test_first_sync_pulls_the_sheet(replica, conn):
+    assert not replica.has_data()
+    assert app.sync_master_replica(replica, conn) == "pulled"
+    assert rows(replica.load_frame()) == SHEET
+    assert not replica.is_pending()
+
+
+def test_unchanged_sheet_is_not_downloaded_again(replica, conn):
+    app.sync_master_replica(replica, conn)
+    calls = conn.worksheet.api_calls
+    version = replica.version()
+    assert app.sync_master_replica(replica, conn) == "unchanged"
+    assert conn.worksheet.api_calls == calls
+    assert replica.version() == version
+
+
+def test_local_edit_is_pushed(replica, conn):
+    app.sync_master_replica(replica, conn)
+    replica.update_frame(lambda df: df.assign(電話番号=["9", "8"]))
+    assert replica.is_pending()
+    assert app.sync_master_replica(replica, conn) == "pushed"
+    assert conn.worksheet.get_all_values() == [
+        ["金融機関名", "電話番号"],
+        ["A銀行", "9"],
+        ["B銀行", "8"],
+    ]
+    assert not replica.is_pending()
+    assert app.sync_master_replica(replica, conn) == "unchanged"
+
+
+def test_remote_edit_made_before_push_is_pulled_afterwards(replica, conn):
+    app.sync_master_replica(replica, conn)
+    replica.update_frame(lambda df: df.assign(電話番号=["9", "8"]))
+    conn.worksheet.batch_update([{"range": "A2", "values": [["A銀行 (改称)"]]}])
+    assert app.sync_master_replica(replica, conn) == "pushed"
+    assert app.sync_master_replica(replica, conn) == "pulled"
+    assert rows(replica.load_frame()) == [
+        ["金融機関名", "電話番号"],
+        ["A銀行 (改称)", "9"],
+        ["B銀行", "8"],
+    ]
+
+
+def test_remote_change_is_pulled(replica, conn):
+    app.sync_master_replica(replica, conn)
+    conn.worksheet.append_rows([["C銀行", "3"]])
+    assert app.sync_master_replica(replica, conn) == "pulled"
+    assert list(replica.load_frame()["金融機関名"]) == ["A銀行", "B銀行", "C銀行"]
+
+
+def test_pull_is_discarded_if_replica_changed_meanwhile(replica):
+    replica.apply_upstream(SHEET, "r1", replica.version())
+    stale = replica.version()
+    replica.write_local(pd.DataFrame([["A銀行", "9"]], columns=SHEET[0]))
+    assert not replica.apply_upstream(SHEET, "r2", stale)
+    assert not replica.apply_upstream(SHEET, "r2", replica.version())
+    assert replica.load_frame().values.tolist() == [["A銀行", "9"]]
+
+
+def test_push_keeps_pending_if_edited_during_push(replica, conn):
+    app.sync_master_replica(replica, conn)
+    replica.update_frame(lambda df: df.assign(電話番号=["9", "8"]))
+    version = replica.version()
+    replica.update_frame(lambda df: df.assign(電話番号=["7", "6"]))
+    replica.mark_pushed(version, "r")
+    assert replica.is_pending()
+
+
+def test_concurrent_edits_are_not_lost(replica, conn):
+    app.sync_master_replica(replica, conn)
+
+    def add(i):
+        replica.update_frame(
+            lambda df: pd.concat(
+                [df, pd.DataFrame([[f"銀行{i}", ""]], columns=df.columns)],
+                ignore_index=True,
+            )
+        )
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(replica.load_frame()) == len(SHEET) - 1 + 8
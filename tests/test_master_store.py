@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import app
+
+
+def frame(names, **columns):
+    return pd.DataFrame({"金融機関名": names, **columns})
+
+
+def test_master_store_looks_up_rows_by_name():
+    store = app.MasterStore(
+        frame(["A銀行", "B銀行", "A銀行"], 電話番号=["1", "2", "3"]), 1
+    )
+    assert store.row("B銀行")["電話番号"] == "2"
+    assert store.row("A銀行")["電話番号"] == "1"
+    assert store.row("なし") is None
+    assert store.names == ("A銀行", "B銀行", "A銀行")
+
+
+def test_frame_is_compact_and_has_no_missing_values():
+    store = app.MasterStore(frame(["A銀行", "B銀行"], 電話番号=[None, "0120"]), 1)
+    assert all(str(dtype) == "string" for dtype in store.frame.dtypes)
+    assert store.frame["電話番号"].tolist() == ["", "0120"]
+
+
+def test_search_index_is_built_once():
+    store = app.MasterStore(frame(["みずほ銀行", "りそな銀行"]), 1)
+    assert store.search_index is store.search_index
+    assert store.search_index.search("ミズホ") == ["みずほ銀行"]
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    app.get_master_replica.clear()
+    app.load_master_store.clear()
+    yield app.get_master_replica()
+    app.get_master_replica.clear()
+    app.load_master_store.clear()
+
+
+def test_store_is_shared_until_the_replica_changes(replica):
+    assert app.get_master_store() is None
+    replica.write_local(frame(["A銀行"]))
+    store = app.get_master_store()
+    assert app.get_master_store() is store
+    replica.update_frame(lambda df: pd.concat([df, frame(["B銀行"])]))
+    assert app.get_master_store() is not store
+    assert app.get_master_store().names == ("A銀行", "B銀行")
@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+from stubs import InMemoryWorksheet, Latency
+
+import app
+
+
+def test_identical_grids_produce_no_writes():
+    grid = [["金融機関名", "電話番号"], ["A銀行", "1"]]
+    assert app.diff_sheet_grid(grid, [list(r) for r in grid]) == ([], [], [])
+
+
+def test_nearby_changed_cells_are_grouped_into_one_range():
+    old = [["a", "b", "c", "d", "e", "f"]]
+    new = [["a", "X", "c", "Y", "e", "f"]]
+    updates, appends, clears = app.diff_sheet_grid(old, new)
+    assert updates == [{"range": "B1:D1", "values": [["X", "c", "Y"]]}]
+    assert appends == [] and clears == []
+
+
+def test_distant_changes_are_separate_ranges():
+    old = [["a", "b", "c", "d", "e", "f"]]
+    new = [["X", "b", "c", "d", "e", "Y"]]
+    updates, _, _ = app.diff_sheet_grid(old, new)
+    assert [u["range"] for u in updates] == ["A1:A1", "F1:F1"]
+
+
+def test_new_rows_are_appended_and_removed_rows_cleared():
+    old = [["h1", "h2"], ["a", "1"], ["b", "2"], ["c", "3"]]
+    new = [["h1", "h2"], ["a", "1"]]
+    assert app.diff_sheet_grid(old, new) == ([], [], ["A3:B4"])
+    _, appends, _ = app.diff_sheet_grid(new, old)
+    assert appends == [["b", "2"], ["c", "3"]]
+
+
+def test_shorter_rows_are_padded_before_comparing():
+    updates, _, _ = app.diff_sheet_grid([["a", "b"]], [["a"]])
+    assert updates == [{"range": "B1:B1", "values": [[""]]}]
+
+
+def sheet(values):
+    return InMemoryWorksheet(values, Latency())
+
+
+def frame(rows):
+    return pd.DataFrame(rows[1:], columns=rows[0])
+
+
+def test_writer_brings_sheet_in_line_with_frame():
+    ws = sheet(
+        [["金融機関名", "電話番号"], ["A銀行", "1"], ["B銀行", "2"], ["C銀行", "3"]]
+    )
+    target = [["金融機関名", "電話番号", "AI要約"], ["A銀行", "9", "要約"]]
+    stats = app.SheetDiffWriter().save(ws, frame(target))
+    assert [row for row in ws.get_all_values() if any(row)] == target
+    assert stats["cleared_rows"] == 2
+    target.append(["D銀行", "4", ""])
+    app.SheetDiffWriter().save(ws, frame(target))
+    assert [row for row in ws.get_all_values() if any(row)] == target
+
+
+def test_unchanged_frame_is_not_written_again():
+    rows = [["金融機関名", "電話番号"], ["A銀行", "1"]]
+    ws = sheet(rows)
+    writer = app.SheetDiffWriter()
+    writer.save(ws, frame(rows))
+    calls = ws.api_calls
+    assert writer.save(ws, frame(rows)) == {
+        "ranges": 0,
+        "cells": 0,
+        "appended_rows": 0,
+        "cleared_rows": 0,
+    }
+    assert ws.api_calls == calls
+
+
+def test_failed_write_rereads_sheet_next_time():
+    rows = [["金融機関名"], ["A銀行"]]
+    ws = sheet(rows)
+    writer = app.SheetDiffWriter()
+    writer.save(ws, frame(rows))
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("network")
+
+    ws.batch_update = fail
+    with pytest.raises(ConnectionError):
+        writer.save(ws, frame([["金融機関名"], ["B銀行"]]))
+    del ws.batch_update
+    writer.save(ws, frame([["金融機関名"], ["B銀行"]]))
+    assert ws.get_all_values() == [["金融機関名"], ["B銀行"]]
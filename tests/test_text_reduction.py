@@ -0,0 +1,38 @@
+import app
+
+
+def test_long_line_is_split_into_bounded_blocks():
+    page = "相続のお手続きについてのご案内です。" * 450
+    blocks = app.split_text_blocks(page)
+    assert len(blocks) > 1
+    assert all(len(b) <= app.BLOCK_MAX_CHARS for b in blocks)
+
+
+def test_page_without_line_breaks_is_never_reduced_to_nothing():
+    page = "相続のお手続きについてのご案内です。" * 450
+    reduced = app.reduce_text_for_extraction(page)
+    assert reduced
+    assert app.estimate_tokens(reduced) <= app.EXTRACT_TOKEN_BUDGET
+
+
+def test_first_block_is_truncated_when_budget_is_tiny():
+    reduced = app.reduce_text_for_extraction("あ" * 1000, token_budget=50)
+    assert reduced == "あ" * 50
+
+
+def test_short_page_is_kept_whole():
+    text = "相続センター\n0120-000-000\n来店予約制です"
+    assert app.reduce_text_for_extraction(text) == text
+
+
+def test_repeated_navigation_lines_are_dropped():
+    text = "\n".join(["ホーム", "本文1", "ホーム", "本文2", "ホーム"])
+    assert app.split_text_blocks(text) == ["本文1\n本文2"]
+
+
+def test_topic_blocks_survive_reduction():
+    filler = "\n\n".join("お知らせ" * 90 for _ in range(60))
+    topic = "貸金庫の相続手続は来店予約のうえ開扉します"
+    reduced = app.reduce_text_for_extraction(filler + "\n" + topic, token_budget=500)
+    assert topic in reduced
+    assert app.estimate_tokens(reduced) <= 500
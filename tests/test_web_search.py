@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+from duckduckgo_search.exceptions import DuckDuckGoSearchException, RatelimitException
+
+import app
+
+
+class FakeEngine:
+    # DDGS の代役。gate を渡すと、その Event が立つまで text() が戻らない
+    def __init__(self, gate=None, errors=()):
+        self.queries = []
+        self.gate = gate
+        self.errors = list(errors)
+        self.entered = threading.Event()
+
+    def text(self, query, max_results=3):
+        self.queries.append(query)
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return [{"href": f"https://example.com/{len(self.queries)}", "body": query}]
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(app, "new_ddgs", lambda: engine)
+    return engine
+
+
+def test_repeated_query_is_served_from_cache(engine):
+    client = app.WebSearchClient()
+    first = client.search("A銀行  相続")
+    assert client.search("A銀行 相続") == first
+    assert engine.queries == ["A銀行 相続"]
+    assert client.stats()["hits"] == 1
+
+
+def test_refresh_bypasses_cache(engine):
+    client = app.WebSearchClient()
+    client.search("A銀行")
+    client.search("A銀行", refresh=True)
+    assert len(engine.queries) == 2
+
+
+def test_concurrent_duplicate_queries_share_one_search(engine):
+    engine.gate = threading.Event()
+    client = app.WebSearchClient()
+    results = []
+    owner = threading.Thread(target=lambda: results.append(client.search("A銀行")))
+    owner.start()
+    assert engine.entered.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(client.search("A銀行")))
+    waiter.start()
+    while client.stats()["coalesced"] == 0:
+        waiter.join(0.01)
+    engine.gate.set()
+    owner.join()
+    waiter.join()
+    assert engine.queries == ["A銀行"]
+    assert results[0] == results[1]
+
+
+def test_failure_reaches_waiters_and_is_not_cached(engine):
+    engine.gate = threading.Event()
+    engine.errors = [DuckDuckGoSearchException("backend down")]
+    client = app.WebSearchClient()
+    errors = []
+
+    def search():
+        try:
+            client.search("A銀行")
+        except DuckDuckGoSearchException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(2)]
+    threads[0].start()
+    assert engine.entered.wait(5)
+    threads[1].start()
+    while client.stats()["coalesced"] == 0:
+        threads[1].join(0.01)
+    engine.gate.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 2
+    assert client.search("A銀行")
+    assert len(engine.queries) == 2
+
+
+def test_rate_limited_search_is_retried(engine, monkeypatch):
+    monkeypatch.setattr(app, "SEARCH_BACKOFF_BASE", 0)
+    monkeypatch.setattr(app.random, "uniform", lambda a, b: 0)
+    engine.errors = [RatelimitException("202 Ratelimit")]
+    client = app.WebSearchClient()
+    assert client.search("A銀行")
+    assert client.stats()["retries"] == 1
+    assert client.stats()["errors"] == 0